@@ -13,14 +13,24 @@ applied at the value P=224 mbar.
 import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
+import os.path
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from resultstore import ResultStore, experiment_date
 
 threshold=11200
 
-dataset = pd.read_csv('pressure_flow_23_Mar_2021.csv')
+datafile='pressure_flow_23_Mar_2021.csv'
+dataset = pd.read_csv(datafile)
 
 P= dataset.P[:threshold]
 Q= dataset.Q[:threshold]
 
+#The calibration points kept for the regression are added to the result store
+ResultStore().append('pq', pd.DataFrame({'Pressure mbar':P, 'Flow ul/min':Q}),
+                     experiment='P-Q calibration', date=experiment_date(datafile), mode='overwrite', run=datafile)
+
 P=P[:,np.newaxis]
 Q=Q[:,np.newaxis]
 
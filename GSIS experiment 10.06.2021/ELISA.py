@@ -6,7 +6,9 @@ Data processing of the ELISA samples from GSIS experiment.
 First the appropriate model for the relationship between the optical density
 readings and the concentration of 'standard' solutions provided in the kit, 
 is established via quadratic and cubic regression. The better of the two is 
-determined visually (although cubic is recommended by the manufacturer).
+determined visually (although cubic is recommended by the manufacturer). The
+curves are fitted by standard_curve.py, and the cubic one is kept with the kit
+lot in the curve store when STORE_CURVE is set.
 
 During the experiment the dilution of KRB high glucose (16.7 mM) sample had
 been tested on the wells E4 (dilution 1/20), E5 (1/30) and E6 (1/10).
@@ -27,37 +29,47 @@ The samples were occupying the following wells:
 import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
+import os.path
+import sys
 
-# Regression model for absorbance vs insulin concentration
-data={'Known_concentration':[0,0.197,0.504,1.54,3.12,6.72],'Standard_optical_density':[0.1853862,0.1905384,0.211486,0.3549538,0.6754186,1.193362]}
-df=pd.DataFrame(data)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from resultstore import ResultStore, experiment_date
+from parsecache import cached
+from plate_reader import read_glomax, PARSER_VERSION
+from plate_layout import PlateLayout
+from standard_curve import fit_curve, CurveStore
+from gsis_layout import GSIS_SAMPLES, STANDARD_CONCENTRATIONS
 
-Con=df.Known_concentration[:,np.newaxis]
-St=df.Standard_optical_density[:,np.newaxis]
+#Lot of the insulin ELISA kit used for the plates of the experiment
+KIT_LOT='GSIS 10.06.2021'
 
-from sklearn.preprocessing import PolynomialFeatures
-poly2 = PolynomialFeatures(degree=2)
-x_poly2= poly2.fit_transform(St)
+#Set to True to keep the cubic curve with the kit lot in the curve store
+#(Results/standard_curves, or STANDARD_CURVES), for elisa_batch.py --kit-lot
+STORE_CURVE=False
 
-poly3 = PolynomialFeatures(degree=3)
-x_poly3= poly3.fit_transform(St)
+# Regression model for absorbance vs insulin concentration
+data={'Known_concentration':STANDARD_CONCENTRATIONS,'Standard_optical_density':[0.1853862,0.1905384,0.211486,0.3549538,0.6754186,1.193362]}
+df=pd.DataFrame(data)
 
-from sklearn.linear_model import LinearRegression
-reg2=LinearRegression()
-reg3=LinearRegression()
+Con=df.Known_concentration.to_numpy()
+St=df.Standard_optical_density.to_numpy()
 
-reg2.fit(x_poly2,Con)
-reg3.fit(x_poly3,Con)
+#Least squares fits of the concentration as a polynomial of the optical density
+quadratic=fit_curve(St,Con,'quadratic',kit_lot=KIT_LOT,plate='N2A100621_ELISA 450nm_10-06-2021_17-35-43.csv',
+                    read='2021-06-10T17:35:43')
+cubic=fit_curve(St,Con,'cubic',kit_lot=KIT_LOT,plate='N2A100621_ELISA 450nm_10-06-2021_17-35-43.csv',
+                read='2021-06-10T17:35:43')
 
-y_pred2=reg2.predict(x_poly2)
-y_pred3=reg3.predict(x_poly3)
+print ('Square model equation: \n'+quadratic.equation())
+print ('\nCubic model equation: \n'+cubic.equation())
 
-print ('Square model equation: \nCon = ',str(reg2.intercept_[0]),' + ',str(reg2.coef_[0,1])+'*St + ',str(reg2.coef_[0,2])+'*St^2')
-print ('\nCubic model equation: \nCon = ',str(reg3.intercept_[0]),' + ',str(reg3.coef_[0,1])+'*St + ',str(reg3.coef_[0,2])+'*St^2 + ',str(reg3.coef_[0,3])+'*St^3')
+#The cubic curve is kept with the kit lot, for the batch processing of the other plates
+if STORE_CURVE:
+    print('\nCubic curve saved to', CurveStore().save(cubic))
 
 x=np.linspace(0.0,3.0,num=3000)
-y2=reg2.intercept_[0]+reg2.coef_[0,1]*x+reg2.coef_[0,2]*x**2
-y3=reg3.intercept_[0]+reg3.coef_[0,1]*x+reg3.coef_[0,2]*x**2+reg3.coef_[0,3]*x**3
+y2=quadratic(x)
+y3=cubic(x)
 
 plt.figure()
 plt.scatter(Con, St, color = 'blue', label='Measured values')
@@ -84,139 +96,38 @@ G	2,023147	2,037394	2,026183	0,1692863	2,078684	2,145769	2,082916	2,094893	0,161
 H	0,1901354	0,1808179	0,1742383	0,1702762	0,1767989	0,1642345	0,1555457	0,1631407	0,1638745	0,2289974	0,4112067	0,162017
 '''
 
-import os.path
 datapath=os.path.abspath(str(input('Enter the file name: ')))
-dataframe = pd.read_csv(datapath, skiprows=[0,1,2,3,4,5,6,7,8,18,19,20,21,22,23,24,25,26,26], delimiter=';', usecols=[2,3,4,5,6,7,8,9,10,11,12,13])
-
-#%% ELISA data arrays 
-
-absorbance_datapoint_lg1='0'
-absorbance_datapoint_hg1='0'
-absorbance_datapoint_lg2='0'
-absorbance_datapoint_lgc='0'
-absorbance_datapoint_hgc='0'
-absorbance_datapoint_wc='0'
-absorbance_datapoint_c='0'
-coefc=0
+dataframe = cached(read_glomax, PARSER_VERSION)(datapath)
 
-#low glucose priod 1
-lg1=[]
+#Date of the plate for the result store, from the file name or the time of the
+#read, checked before the analysis rather than when the results are stored
+read_date = experiment_date(os.path.basename(datapath)) or (dataframe.attrs.get('timestamp') or '')[:10] or None
+if read_date is None:
+    sys.exit('No date in the name of '+datapath+' nor in the export, the results could not be stored')
 
-#high glucose period
-hg1=[]
+#%% Plate layout of the ELISA samples
 
-#low glucose period 2
-lg2=[]
+#Every sample was taken 2 minutes after the previous one, from the start of the
+#first low glucose period (gsis_layout.py, shared with elisa_batch.py)
+layout = PlateLayout.from_spec(GSIS_SAMPLES)
 
-#low glucose control
-lgc=[]
+#%% Insulin concentration of all the wells from the cubic model, negative values being 0
 
-#high glucise control
-hgc=[]
+insulin_table = layout.convert(dataframe, cubic, low=0)
+concentration = insulin_table['Insulin ug/L'].to_numpy()
 
-#water control
-wc=[]
+#Wells read outside the OD range of the standards, where the cubic is extrapolated
+out_of_range = insulin_table[~insulin_table['In range'] & insulin_table['Optical density'].notna()]
+print('\n%d of %d wells outside the range of the standards (OD %.3f - %.3f):' %
+      (len(out_of_range), len(insulin_table), cubic.od_range[0], cubic.od_range[1]), ', '.join(out_of_range['Well']))
 
-#content
-c=[]
-
-#%% ELISA dataset fromation from the designated 96-well plate locaitons
-
-def ab_to_con(value,coef):
-    
-    if isinstance(value, str)==True:
-        
-        value=float(value.replace(',','.'))
-        
-    con_value=coef*(reg3.intercept_[0]+reg3.coef_[0,1]*value+reg3.coef_[0,2]*value**2+reg3.coef_[0,3]*value**3)
-    
-    if con_value<0:
-        
-        con_value=0
-    
-    return con_value
-
-for i in range (30):
-    
-    if i<=11:
-        
-        absorbance_datapoint_lg1=dataframe.iloc[0,i]
-        
-        absorbance_datapoint_hg1=dataframe.iloc[2,i]
-        
-        absorbance_datapoint_lg2=dataframe.iloc[5,i]
-        
-        if i<=2:
-            
-            absorbance_datapoint_lgc=dataframe.iloc[7,i]
-            
-            lgc.append(ab_to_con(absorbance_datapoint_lgc,30))
-            
-        elif i>2 and i<=5:
-            
-            absorbance_datapoint_hgc=dataframe.iloc[7,i]
-            
-            hgc.append(ab_to_con(absorbance_datapoint_hgc,30))
-            
-        lg1.append(ab_to_con(absorbance_datapoint_lg1,30))
-        
-        hg1.append(ab_to_con(absorbance_datapoint_hg1,30))
-        
-        lg2.append(ab_to_con(absorbance_datapoint_lg2,30))
-        
-    elif i>11 and i<=14:
-        
-        absorbance_datapoint_lg1=dataframe.iloc[1,i-12]
-        
-        absorbance_datapoint_hg1=dataframe.iloc[3,i-12]
-        
-        absorbance_datapoint_lg2=dataframe.iloc[6,i-12]
-        
-        lg1.append(ab_to_con(absorbance_datapoint_lg1,30))
-        
-        hg1.append(ab_to_con(absorbance_datapoint_hg1,30))
-        
-        lg2.append(ab_to_con(absorbance_datapoint_lg2,30))
-        
-    elif i>14 and i<=23:
-        
-        absorbance_datapoint_hg1=dataframe.iloc[3,i-12]
-        
-        absorbance_datapoint_wc=dataframe.iloc[1,i-12]
-        
-        if i==16:
-            
-            absorbance_datapoint_c=dataframe.iloc[6,i-12]
-            
-            c.append(ab_to_con(absorbance_datapoint_c,40))
-            
-        elif i==17:
-            
-            absorbance_datapoint_c=dataframe.iloc[6,i-12]
-            
-            c.append(ab_to_con(absorbance_datapoint_c,20))
-        
-        elif i==18:
-            
-            absorbance_datapoint_c=dataframe.iloc[6,i-12]
-
-            c.append(ab_to_con(absorbance_datapoint_c,10))
-            
-        elif i==19:
-            
-            absorbance_datapoint_c=dataframe.iloc[6,i-12]
-            
-            c.append(ab_to_con(absorbance_datapoint_c,1))
-        
-        hg1.append(ab_to_con(absorbance_datapoint_hg1,30))
-        
-        wc.append(ab_to_con(absorbance_datapoint_wc,1))
-        
-    elif i>23 and i<=29:
-        
-        absorbance_datapoint_hg1=dataframe.iloc[4,i-24]
-        
-        hg1.append(ab_to_con(absorbance_datapoint_hg1,30))
+lg1 = concentration[layout.mask('Low glucose 1')]
+hg1 = concentration[layout.mask('High glucose')]
+lg2 = concentration[layout.mask('Low glucose 2')]
+lgc = concentration[layout.mask('Low glucose control')]
+hgc = concentration[layout.mask('High glucose control')]
+wc = concentration[layout.mask('Water control')]
+c = concentration[layout.mask('Content')]
 
 #%% Control averages and standard deviations
 water_control=np.mean(wc)
@@ -261,12 +172,15 @@ plt.show()
 
 #%% Collective GSIS dataset for all periods
 
-hg1[27]=2*hg1[27]/3
-hg1[29]=hg1[29]/3
+periods = layout.mask('Low glucose 1', 'High glucose', 'Low glucose 2')
+insulin_concentration = concentration[periods]
+timepoint = insulin_table['Timepoint min'].to_numpy()[periods]
 
-insulin_concentration=lg1+hg1+lg2
+#%% Insulin concentration of every well added to the result store
 
-timepoint = np.arange(0,2*len(insulin_concentration),2)
+insulin_table.insert(0, 'Plate', os.path.basename(datapath))
+ResultStore().append('insulin', insulin_table, experiment='GSIS', date=read_date,
+                     mode='overwrite', run=os.path.basename(datapath))
 
 #%% GSIS plot - measured concentration
 
@@ -297,7 +211,6 @@ plt.show()
 
 number_of_islets=50
 
-insulin_concentration=np.array(insulin_concentration)
 normalised_insulin_concentration=100*insulin_concentration/(number_of_islets*content)
 
 fig2=plt.figure()
@@ -0,0 +1,281 @@
+"""
+Batch ELISA processing
+
+Non-interactive version of ELISA.py for whole run directories. Every GloMax
+export found in the folders (and their sub-folders) is parsed, the plates
+being read in parallel by a pool of threads so that the time taken is that of
+reading the files. The wells of every plate are converted to insulin
+concentrations at once by the PlateLayout of the plate (plate_layout.py).
+
+Each plate gets its own standard curve (standard_curve.py), the cubic model
+of ELISA.py by default, fitted to the standards read on it. A plate without
+standards takes the curve of the plate with standards of the same folder read
+closest to it (the GloMax names the exports by the time of the read), as in
+the GSIS experiment where the standards were read on the first plate
+(17-35-43) and the samples on the second (21-41-59). With a kit lot given,
+the curves fitted are saved in the CurveStore under the lot, and a plate of a
+folder without any standards takes the curve of the lot stored by an earlier
+run whose plate was read closest in time to it.
+
+The results are merged into one long table, one row per well of every plate
+(Plate, Well, Group, dilution, optical density, insulin, whether the OD is
+within the range of the standards, the plate whose standards gave the curve),
+and a table of the plates with the time and the wavelength of the read, the
+number of wells out of range, their curve and any error:
+
+    python elisa_batch.py "GSIS experiment 10.06.2021" --out results
+
+The layout of a plate is chosen by the role of the plate. A folder can hold
+a layout file, elisa_layout.json, giving the role or the layout of its plates
+by file name pattern:
+
+    {"*_17-35-43.csv": "standards",
+     "*_21-41-59.csv": "samples",
+     "*_extra_*.csv": {"Samples": {"wells": "A1-D12", "dilution": 30}}}
+
+the role being a key of LAYOUTS (the standards and the samples plates of the
+GSIS experiment, gsis_layout.py) and a layout a PlateLayout.from_spec()
+dictionary. --layout gives such a file for the folders without one of their
+own. A plate that no pattern matches takes the role whose layout holds the
+most of the wells read on it, so a standards plate and a samples plate of the
+same folder are told apart by what was read on them.
+"""
+
+import os
+import sys
+import json
+import datetime
+import fnmatch
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from plate_reader import read_glomax, PARSER_VERSION
+from plate_layout import PlateLayout
+from gsis_layout import GSIS_SAMPLES, GSIS_STANDARDS
+from standard_curve import fit_curve, closest_curve, CurveStore
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from parsecache import ParseCache
+
+
+#Model of the standard curve (cubic, as recommended by the manufacturer)
+CURVE_MODEL = 'cubic'
+
+#Layout of the plates by role
+LAYOUTS = {'standards': PlateLayout.from_spec(GSIS_STANDARDS),
+           'samples': PlateLayout.from_spec(GSIS_SAMPLES)}
+
+#Layout file of a folder, see the module docstring
+LAYOUT_FILE = 'elisa_layout.json'
+
+
+#GloMax exports have a 'PlateResults' line, other csv files (trypan_blue_plate.csv) do not
+def is_glomax(datapath):
+    try:
+        with open(datapath, encoding='latin-1') as f:
+            return any(line.strip() == 'PlateResults' for line, _ in zip(f, range(200)))
+    except OSError:
+        return False
+
+
+#Every GloMax export under the given folders, sorted by folder and name
+def discover(folders):
+    if isinstance(folders, str):
+        folders = [folders]
+    plates = []
+    for folder in folders:
+        for root, dirs, files in os.walk(folder):
+            dirs.sort()
+            plates.extend(os.path.join(root, name) for name in sorted(files)
+                          if name.lower().endswith('.csv') and is_glomax(os.path.join(root, name)))
+    return plates
+
+
+#Layouts by file name pattern of a layout file, the roles being taken from layouts
+def read_layout_file(path, layouts=LAYOUTS, size=96):
+    with open(path) as f:
+        entries = json.load(f)
+    patterns = {}
+    for pattern, entry in entries.items():
+        if isinstance(entry, str):
+            if entry not in layouts:
+                raise ValueError('Unknown plate role %r in %s, use one of %s' % (entry, path, ', '.join(layouts)))
+            patterns[pattern] = layouts[entry]
+        else:
+            patterns[pattern] = PlateLayout.from_spec(entry, size)
+    return patterns
+
+
+#Role of a plate: the one whose layout holds the most wells read on it, None
+#when no well of any layout was read
+def plate_role(plate, layouts=LAYOUTS):
+    read = np.isfinite(np.asarray(plate, dtype=np.float64))
+    counts = {role: int(read[layout.rows, layout.columns].sum()) for role, layout in layouts.items()
+              if read.shape == layout.shape}
+    role = max(counts, key=counts.get, default=None)
+    return role if role is not None and counts[role] > 0 else None
+
+
+#Layout of a plate: from the first pattern of the layout file of its folder (or
+#of default) matching its name, else by its role
+def layout_of(datapath, plate, layouts=LAYOUTS, patterns=None):
+    name = os.path.basename(datapath)
+    for pattern, layout in (patterns or {}).items():
+        if fnmatch.fnmatch(name, pattern):
+            return layout
+    role = plate_role(plate, layouts) if plate is not None else None
+    return layouts[role] if role is not None else None
+
+
+#Layout file patterns of every folder of the paths, default for the folders without a file
+def _folder_patterns(paths, layouts, default=None, size=96):
+    patterns = {}
+    for folder in sorted({os.path.dirname(datapath) for datapath in paths}):
+        path = os.path.join(folder, LAYOUT_FILE)
+        patterns[folder] = read_layout_file(path, layouts, size) if os.path.isfile(path) else default
+    return patterns
+
+
+#Standard curve fitted to the standards read on a plate, None when there are
+#too few of them or the fit fails
+def plate_curve(plate, layout, name, model=CURVE_MODEL, kit_lot=None):
+    od, concentration = layout.standards(plate)
+    if not len(od):
+        return None
+    try:
+        return fit_curve(od, concentration, model, kit_lot=kit_lot, plate=name, read=plate.attrs.get('timestamp'))
+    except (ValueError, RuntimeError):
+        return None
+
+
+def _read(datapath, cache=None):
+    try:
+        parser = read_glomax if cache is None else (lambda path: cache.load(path, read_glomax, PARSER_VERSION))
+        return parser(datapath), None
+    except Exception as err:
+        return None, '%s: %s' % (type(err).__name__, err)
+
+
+#Plate with standards for every plate: its own, else the one of the same folder
+#read closest in time (times, ISO format, from the exports), or closest in the
+#order of the exports when the times are not known
+def _curve_plates(paths, has_curve, times=None):
+    times = [datetime.datetime.fromisoformat(t) if t else None for t in (times or [None]*len(paths))]
+    chosen = []
+    for k, datapath in enumerate(paths):
+        if has_curve[k]:
+            chosen.append(k)
+            continue
+        folder = os.path.dirname(datapath)
+        others = [j for j in range(len(paths)) if has_curve[j] and os.path.dirname(paths[j]) == folder]
+        if times[k] is not None and all(times[j] is not None for j in others):
+            distance = lambda j: (abs((times[j]-times[k]).total_seconds()), abs(j-k))
+        else:
+            distance = lambda j: abs(j-k)
+        chosen.append(min(others, key=distance) if others else None)
+    return chosen
+
+
+#Parse every plate under folders concurrently and convert its wells. Returns the
+#long table of the wells and the table of the plates
+def elisa_batch(folders, layouts=LAYOUTS, out=None, workers=None, cache=None, verbose=True,
+                model=CURVE_MODEL, kit_lot=None, curves=None, patterns=None, size=96):
+    paths = discover(folders)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        plates = list(pool.map(lambda datapath: _read(datapath, cache), paths))
+
+    folder_patterns = _folder_patterns(paths, layouts, patterns, size)
+    layout = [layout_of(datapath, plate, layouts, folder_patterns[os.path.dirname(datapath)])
+              for datapath, (plate, _) in zip(paths, plates)]
+    errors = [error if error is not None else None if layout[k] is not None else 'No layout for this plate'
+              for k, (_, error) in enumerate(plates)]
+    fitted = [plate_curve(plate, layout[k], os.path.basename(paths[k]), model, kit_lot) if errors[k] is None else None
+              for k, (plate, _) in enumerate(plates)]
+    chosen = _curve_plates(paths, [c is not None for c in fitted],
+                           [plate.attrs.get('timestamp') if plate is not None else None for plate, _ in plates])
+
+    #Curves of the kit lot stored by earlier runs for the folders without standards,
+    #taken before the curves of this run are saved with the lot (and without the
+    #fits of these plates saved by an earlier run of the batch)
+    stored = []
+    if kit_lot is not None:
+        curves = curves if curves is not None else CurveStore()
+        names = {os.path.basename(datapath) for datapath in paths}
+        stored = [curve for curve in curves.curves(kit_lot) if curve.plate not in names]
+        for curve in fitted:
+            if curve is not None:
+                curves.save(curve)
+
+    tables = []
+    rows = []
+    for k, datapath in enumerate(paths):
+        plate, _ = plates[k]
+        name = os.path.basename(datapath)
+        attrs = plate.attrs if plate is not None else {}
+        curve = fitted[chosen[k]] if chosen[k] is not None else closest_curve(stored, attrs.get('timestamp'))
+        error = errors[k]
+        if error is None and curve is None:
+            error = 'No standards read on the plate or in its folder'
+        if error is None:
+            table = layout[k].convert(plate, curve, low=0)
+            table.insert(0, 'Plate', name)
+            table['Curve plate'] = curve.plate
+            tables.append(table)
+        else:
+            curve = None
+            if verbose:
+                print('Failed:', datapath, '-', error)
+        rows.append((name, os.path.dirname(datapath), attrs.get('timestamp'), attrs.get('wavelength'),
+                     len(layout[k].wells) if layout[k] is not None else 0,
+                     int((~table['In range'] & table['Optical density'].notna()).sum()) if curve is not None else None,
+                     curve.plate if curve is not None else None, curve.model if curve is not None else None,
+                     json.dumps(curve.params) if curve is not None else None,
+                     curve.table.max_error if curve is not None and curve.table is not None else None, datapath, error))
+
+    plate_table = pd.DataFrame(rows, columns=['Plate', 'Folder', 'Timestamp', 'Wavelength nm', 'Wells', 'Out of range',
+                                              'Curve plate', 'Curve model', 'Curve parameters', 'Curve table error',
+                                              'Path', 'Error'])
+    columns = ['Plate', 'Well', 'Group', 'Dilution', 'Replicate', 'Timepoint min', 'Known concentration',
+               'Optical density', 'Insulin ug/L', 'In range', 'Curve plate']
+    insulin_table = pd.concat(tables, ignore_index=True) if tables else pd.DataFrame(columns=columns)
+
+    if verbose:
+        for _, r in plate_table[plate_table['Error'].isna()].iterrows():
+            print('%s: %d wells (%d outside the range of the standards), standard curve of %s'
+                  % (r['Plate'], r['Wells'], r['Out of range'], r['Curve plate']))
+
+    if out is not None:
+        os.makedirs(out, exist_ok=True)
+        insulin_table.to_csv(os.path.join(out, 'elisa_wells.csv'), index=False)
+        plate_table.to_csv(os.path.join(out, 'elisa_plates.csv'), index=False)
+
+    return insulin_table, plate_table
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Insulin concentration of every well of the ELISA plates in folders')
+    parser.add_argument('folders', nargs='+')
+    parser.add_argument('--out', default='elisa_results')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--layout', default=None, help='layout file for the folders without '+LAYOUT_FILE)
+    parser.add_argument('--size', type=int, default=96, help='wells of the plates of the layout files')
+    parser.add_argument('--model', default=CURVE_MODEL, help='standard curve: linear, quadratic, cubic, 4pl or 5pl')
+    parser.add_argument('--kit-lot', default=None, help='save the curves under this kit lot and use them for '
+                                                         'the plates without standards')
+    parser.add_argument('--store', action='store_true', help='also append the wells to the result store')
+    parser.add_argument('--no-cache', action='store_true', help='parse every export again')
+    args = parser.parse_args()
+
+    patterns = read_layout_file(args.layout, LAYOUTS, args.size) if args.layout is not None else None
+    cache = None if args.no_cache else ParseCache()
+    insulin_table, plate_table = elisa_batch(args.folders, LAYOUTS, args.out, args.workers, cache,
+                                             model=args.model, kit_lot=args.kit_lot, patterns=patterns, size=args.size)
+
+    if args.store:
+        from resultstore import ResultStore, experiment_date
+        store = ResultStore()
+        for plate, table in insulin_table.groupby('Plate', sort=False):
+            store.append('insulin', table, experiment='GSIS', date=experiment_date(plate), mode='overwrite', run=plate)
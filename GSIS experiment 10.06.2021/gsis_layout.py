@@ -0,0 +1,33 @@
+"""
+Plate layouts of the GSIS experiment
+
+The wells of the two ELISA plates of the experiment, as the dictionaries of
+PlateLayout.from_spec() (plate_layout.py), shared by ELISA.py and
+elisa_batch.py:
+
+    - GSIS_STANDARDS, the first plate: the standards of the kit on H7 -> H12
+      and the dilution test of the KRB high glucose sample on E4 (1/20),
+      E5 (1/30) and E6 (1/10)
+    - GSIS_SAMPLES, the second plate: the samples of the three periods, taken
+      every 2 minutes from the start of the first low glucose period, the
+      controls and the content, see the docstring of ELISA.py
+"""
+
+
+#Known concentrations of the standards of the kit, ug/L
+STANDARD_CONCENTRATIONS = [0, 0.197, 0.504, 1.54, 3.12, 6.72]
+
+GSIS_STANDARDS = {
+    'Standard':             {'wells': 'H7-H12', 'concentration': STANDARD_CONCENTRATIONS},
+    'Dilution test':        {'wells': 'E4-E6', 'dilution': [20, 30, 10]}}
+
+#The wells E4 and E6 of the high glucose period were diluted 1/20 and 1/10
+GSIS_SAMPLES = {
+    'Low glucose 1':        {'wells': 'A1-B3', 'dilution': 30, 'timepoint': list(range(0, 30, 2))},
+    'High glucose':         {'wells': 'C1-E6', 'dilution': 30, 'dilutions': {'E4': 20, 'E6': 10},
+                             'timepoint': list(range(30, 90, 2))},
+    'Low glucose 2':        {'wells': 'F1-G3', 'dilution': 30, 'timepoint': list(range(90, 120, 2))},
+    'Low glucose control':  {'wells': 'H1-H3', 'dilution': 30},
+    'High glucose control': {'wells': 'H4-H6', 'dilution': 30},
+    'Water control':        {'wells': 'B4-B12', 'dilution': 1},
+    'Content':              {'wells': 'G5-G8', 'dilution': [40, 20, 10, 1]}}
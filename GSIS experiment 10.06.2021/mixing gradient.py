@@ -15,18 +15,18 @@ The plate has following layout:
     
 """
 
-import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
 
 import os.path
-datapath=os.path.abspath(str(input('Enter the file name: ')))
-dataframe = pd.read_csv(datapath, delimiter=';', usecols=[1,2,3,4,5])
+import sys
 
-#%%
-for i in range(dataframe.shape[0]):
-    for j in range(dataframe.shape[1]):
-        dataframe.iloc[i,j]=float(dataframe.iloc[i,j].replace(',','.'))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from parsecache import cached
+from plate_reader import read_plate, PARSER_VERSION
+
+datapath=os.path.abspath(str(input('Enter the file name: ')))
+dataframe = cached(read_plate, PARSER_VERSION)(datapath)[['1','2','3','4','5']]
 
 #%%
 mixing_grad=np.array([])
@@ -0,0 +1,197 @@
+"""
+Plate layouts
+
+A PlateLayout says what is in the wells of a 96 or 384 well plate: the group
+of samples a well belongs to, the dilution of the sample, its replicate number
+and the time point at which it was collected, or the known concentration of a
+standard of the kit. It is written once per
+experiment as a plain dictionary, e.g. for the ELISA plate of the GSIS
+experiment:
+
+    layout = PlateLayout.from_spec({
+        'Low glucose 1': {'wells': 'A1-B3', 'dilution': 30, 'timepoint': range(0, 30, 2)},
+        'High glucose':  {'wells': 'C1-E6', 'dilution': 30, 'dilutions': {'E4': 20, 'E6': 10}},
+        'Content':       {'wells': 'G5-G8', 'dilution': [40, 20, 10, 1]},
+        'Standard':      {'wells': 'H7-H12', 'concentration': [0, 0.197, 0.504, 1.54, 3.12, 6.72]},
+        ...})
+
+Wells are given as a list ('A1', 'B12', ...) or as ranges 'A1-B3' going along
+the rows in reading order (A1 ... A12, B1, B2, B3), several ranges being
+separated by commas. A dilution, replicate or time point is one value for
+the whole group or one value per well, and 'dilutions' overrides the dilution
+of single wells. The wells given a 'concentration' are the standards, from
+which standards() returns the points of the standard curve of a plate.
+
+The layout keeps the row and column index, the dilution, ... of its wells as
+arrays, so convert() takes the optical densities of all the wells out of the
+plate in one indexing step and turns them into concentrations with one call
+of the standard curve:
+
+    concentration = dilution*clip(curve(optical density), low, high)
+
+The curve is any function of an array of optical densities, e.g. a
+numpy.polynomial.Polynomial.
+"""
+
+import re
+
+import numpy as np
+import pandas as pd
+
+
+ROWS = 'ABCDEFGHIJKLMNOP'
+
+#Rows and columns of the plate formats
+PLATE_SHAPES = {96: (8, 12), 384: (16, 24)}
+
+WELL = re.compile(r'^([A-Pa-p])0*(\d{1,2})$')
+
+
+#Row and column index (from 0) of a well name such as 'E4'
+def well_index(well):
+    match = WELL.match(well.strip())
+    if match is None:
+        raise ValueError('Not a well name: %r' % well)
+    return ROWS.index(match.group(1).upper()), int(match.group(2))-1
+
+
+def well_name(row, column):
+    return ROWS[row]+str(column+1)
+
+
+#Names of the wells of 'A1-B3, H4' (or of a list of such names), the ranges
+#going along the rows of a plate of the given number of columns
+def expand_wells(wells, columns=12):
+    if isinstance(wells, str):
+        wells = [part for part in wells.split(',') if part.strip()]
+    names = []
+    for part in wells:
+        if '-' in part:
+            first, last = part.split('-')
+            (r0, c0), (r1, c1) = well_index(first), well_index(last)
+            start, stop = r0*columns+c0, r1*columns+c1
+            if stop < start:
+                raise ValueError('Well range going backwards: '+part)
+            names.extend(well_name(k//columns, k%columns) for k in range(start, stop+1))
+        else:
+            names.append(well_name(*well_index(part)))
+    return names
+
+
+def _per_well(value, n, name, group):
+    values = np.asarray(value, dtype=np.float64) if value is not None else np.full(n, np.nan)
+    if values.ndim == 0:
+        return np.full(n, float(values))
+    if len(values) != n:
+        raise ValueError('%d %s values for the %d wells of %s' % (len(values), name, n, group))
+    return values
+
+
+class PlateLayout:
+
+    def __init__(self, size=96):
+        try:
+            self.shape = PLATE_SHAPES[size]
+        except KeyError:
+            raise ValueError('Unknown plate size %r, use one of %s' % (size, ', '.join(map(str, PLATE_SHAPES)))) from None
+        self.size = size
+        self.groups = []
+        self.rows = np.empty(0, np.intp)
+        self.columns = np.empty(0, np.intp)
+        self.group = np.empty(0, np.intp)
+        self.dilution = np.empty(0)
+        self.replicate = np.empty(0)
+        self.timepoint = np.empty(0)
+        self.concentration = np.empty(0)
+
+    #Layout from a dictionary {group: {'wells':..., 'dilution':..., 'dilutions':...,
+    #'replicate':..., 'timepoint':..., 'concentration':...}}, the groups in the
+    #order of the dictionary
+    @classmethod
+    def from_spec(cls, spec, size=96):
+        layout = cls(size)
+        for group, entry in spec.items():
+            if isinstance(entry, (str, list, tuple)):
+                entry = {'wells': entry}
+            layout.add(group, **entry)
+        return layout
+
+    #Add the wells of a group. The replicates are numbered from 1 in the order of
+    #the wells unless given. concentration is the known concentration of standards
+    def add(self, group, wells, dilution=1, dilutions=None, replicate=None, timepoint=None, concentration=None):
+        names = expand_wells(wells, self.shape[1])
+        index = np.array([well_index(name) for name in names], dtype=np.intp).reshape(-1, 2)
+        if (index >= self.shape).any():
+            raise ValueError('Wells of %s outside a %d well plate' % (group, self.size))
+        taken = set(zip(self.rows.tolist(), self.columns.tolist()))
+        twice = [name for name, (r, c) in zip(names, index.tolist()) if (r, c) in taken]
+        if twice or len(set(names)) < len(names):
+            raise ValueError('Wells given twice in the layout: '+', '.join(twice or names))
+
+        n = len(names)
+        dilution = _per_well(dilution, n, 'dilution', group)
+        for well, value in (dilutions or {}).items():
+            dilution[names.index(well_name(*well_index(well)))] = value
+        replicate = np.arange(1, n+1) if replicate is None else _per_well(replicate, n, 'replicate', group)
+        timepoint = _per_well(timepoint, n, 'timepoint', group)
+        concentration = _per_well(concentration, n, 'concentration', group)
+
+        if group not in self.groups:
+            self.groups.append(group)
+        self.rows = np.append(self.rows, index[:, 0])
+        self.columns = np.append(self.columns, index[:, 1])
+        self.group = np.append(self.group, np.full(n, self.groups.index(group), np.intp))
+        self.dilution = np.append(self.dilution, dilution)
+        self.replicate = np.append(self.replicate, replicate)
+        self.timepoint = np.append(self.timepoint, timepoint)
+        self.concentration = np.append(self.concentration, concentration)
+        return self
+
+    @property
+    def wells(self):
+        return [well_name(r, c) for r, c in zip(self.rows, self.columns)]
+
+    #One row per well of the layout, in the order the wells were added
+    def table(self):
+        return pd.DataFrame({'Well': self.wells, 'Group': np.array(self.groups, dtype=object)[self.group],
+                             'Dilution': self.dilution, 'Replicate': self.replicate.astype(np.int32),
+                             'Timepoint min': self.timepoint, 'Known concentration': self.concentration})
+
+    #Optical densities of the wells of the layout from a plate grid (a DataFrame
+    #of read_glomax() or an array of the shape of the plate)
+    def optical_density(self, plate):
+        grid = np.asarray(plate, dtype=np.float64)
+        if grid.shape != self.shape:
+            raise ValueError('Plate of shape %s for a %d well layout' % (grid.shape, self.size))
+        return grid[self.rows, self.columns]
+
+    #Concentration in every well of the layout, see the module docstring. Returns
+    #the table() with the 'Optical density' and the concentration column, and for
+    #a StandardCurve the 'In range' flag of the ODs within the range of its standards
+    def convert(self, plate, curve, low=0.0, high=None, name='Insulin ug/L'):
+        od = self.optical_density(plate)
+        table = self.table()
+        table['Optical density'] = od
+        table[name] = convert(od, curve, self.dilution, low, high)
+        if hasattr(curve, 'valid'):
+            table['In range'] = curve.valid(od)
+        return table
+
+    #Optical densities and known concentrations of the standards read on the plate
+    def standards(self, plate):
+        od = self.optical_density(plate)
+        read = np.isfinite(self.concentration) & np.isfinite(od)
+        return od[read], self.concentration[read]
+
+    #Wells of the given groups, as a boolean mask over the wells of the layout
+    def mask(self, *groups):
+        return np.isin(self.group, [self.groups.index(g) for g in groups])
+
+
+#Concentration of the undiluted samples from the optical densities: the curve
+#clipped to [low, high] (no bound for None) times the dilution, all arrays
+def convert(od, curve, dilution=1, low=0.0, high=None):
+    concentration = curve(np.asarray(od, dtype=np.float64))
+    if low is not None or high is not None:
+        concentration = np.clip(concentration, low, high)
+    return np.asarray(dilution, dtype=np.float64)*concentration
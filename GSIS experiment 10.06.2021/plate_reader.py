@@ -0,0 +1,162 @@
+"""
+Plate reader exports
+
+read_plate() reads the plate readings used in the GSIS experiment (read_glomax
+is another name of it):
+
+    - the CSV files saved by the Promega GloMax (ELISA at 450 nm), where the
+      absorbance grid follows the protocol lines:
+
+        Protocol Description
+        ;Protocol name: ELISA 450nm
+        ;Result File name: ...\\N2A100621_ELISA 450nm_10-06-2021_17-35-43.csv
+        Step 1;Absorbance;450nm, 1 repeat, 96 well plate
+        PlateResults
+        ;Read 1;450;nm
+        ;;1;2;3;...;12
+        ;A;2,018699;2,042031;...      <- 'X' for the wells that were not read
+
+    - plain plate grids such as trypan_blue_plate.csv, with the column numbers
+      on the first row, the row letters in the first column and a label
+      (e.g. 'trypan blue:580') after the last column
+
+The file is read once, line by line, and the grid is found by its header
+rather than by its line number: a row of the column numbers 1 ... 12 (or
+1 ... 24 for a 384 well plate) followed by the rows A, B, ... in the column
+just before the numbers. The grid is returned as
+a float DataFrame with the row letters as index and the column numbers
+('1' ... '12') as columns, the wells that were not read or are empty being
+NaN. The decimal commas are turned into points on the whole grid at once and
+the grid is converted to float in one step.
+
+What the file says about the reading is kept in the attrs of the DataFrame:
+
+    'protocol'    the 'name: value' lines before the grid
+    'name'        the protocol name (ELISA 450nm)
+    'timestamp'   the time of the read from the result file name, ISO format
+    'wavelength'  in nm, from the step, the read line or the label
+    'step'        e.g. 'Absorbance', 'read' e.g. 'Read 1 450 nm'
+    'labels'      the labels after the last column
+"""
+
+import re
+import datetime
+
+import numpy as np
+import pandas as pd
+
+
+#Bump when the output of the readers changes, so that the parse cache is refreshed
+PARSER_VERSION = 2
+
+ROWS = 'ABCDEFGHIJKLMNOP'
+
+#Number of columns of the plate formats
+PLATE_COLUMNS = (12, 24)
+
+TIMESTAMP = re.compile(r'(\d{2})-(\d{2})-(\d{4})_(\d{2})-(\d{2})-(\d{2})')
+WAVELENGTH = re.compile(r'(\d{3,4})\s*nm', re.IGNORECASE)
+
+
+#Position of the first column number and the number of columns when the fields
+#are a grid header (1, 2, ... 12 or 24 after empty fields), else None
+def _grid_header(fields):
+    offset = 0
+    while offset < len(fields) and not fields[offset].strip():
+        offset += 1
+    numbers = [x.strip() for x in fields[offset:]]
+    while numbers and not numbers[-1]:
+        numbers.pop()
+    if len(numbers) in PLATE_COLUMNS and numbers == [str(k) for k in range(1, len(numbers)+1)]:
+        return offset, len(numbers)
+    return None
+
+
+#Float array of the grid cells, the decimal commas and the 'X' or empty cells
+#of the wells that were not read being dealt with on the whole array at once
+def _to_float(cells):
+    cells = np.char.strip(np.asarray(cells, dtype=str))
+    missing = (cells == '') | (cells == 'X')
+    cells = np.where(missing, 'nan', np.char.replace(cells, ',', '.'))
+    return cells.astype(np.float64)
+
+
+def _timestamp(text):
+    match = TIMESTAMP.search(text)
+    if match is None:
+        return None
+    day, month, year, hour, minute, second = map(int, match.groups())
+    try:
+        return datetime.datetime(year, month, day, hour, minute, second).isoformat()
+    except ValueError:
+        return None
+
+
+def read_plate(datapath):
+    meta = {}
+    protocol = {}
+    before = []
+    index = []
+    rows = []
+    labels = set()
+    offset = None
+    columns = 0
+
+    with open(datapath, encoding='latin-1') as f:
+        for line in f:
+            fields = line.rstrip('\r\n').split(';')
+            if offset is None:
+                header = _grid_header(fields)
+                if header is None:
+                    before.append(fields)
+                    continue
+                offset, columns = header
+                if offset == 0:
+                    raise ValueError('No row letters before the grid in '+datapath)
+                continue
+
+            #Rows A, B, ... in the column before the numbers, the grid ends at the first other line
+            letter = fields[offset-1].strip() if len(fields) >= offset else ''
+            if len(index) == len(ROWS) or letter != ROWS[len(index)]:
+                break
+            cells = fields[offset:offset+columns]
+            rows.append(cells+['']*(columns-len(cells)))
+            labels.update(x.strip() for x in fields[offset+columns:] if x.strip())
+            index.append(letter)
+
+    if offset is None:
+        raise ValueError('No plate grid (a row of the column numbers 1 ... 12) found in '+datapath)
+
+    #Protocol lines before the grid, e.g. ';Protocol name: ELISA 450nm', the step
+    #'Step 1;Absorbance;450nm, ...' and the read ';Read 1;450;nm'
+    for fields in before:
+        text = [x.strip() for x in fields if x.strip()]
+        if not text:
+            continue
+        if len(text) == 1 and ':' in text[0]:
+            name, value = text[0].split(':', 1)
+            protocol[name.strip()] = value.strip()
+        elif text[0].lower().startswith('step') and len(text) > 1:
+            meta['step'] = text[1]
+            meta['settings'] = ';'.join(text[2:])
+        elif text[0].lower().startswith('read'):
+            meta['read'] = ' '.join(text)
+
+    plate = pd.DataFrame(_to_float(rows).reshape(len(rows), columns), index=pd.Index(index, name='Row'),
+                         columns=[str(k) for k in range(1, columns+1)])
+
+    meta['protocol'] = protocol
+    meta['name'] = protocol.get('Protocol name')
+    meta['timestamp'] = _timestamp(protocol.get('Result File name', '')) or _timestamp(datapath)
+    wavelength = WAVELENGTH.search(meta.get('settings', '')) or WAVELENGTH.search(meta.get('read', ''))
+    if wavelength is None and labels:
+        wavelength = re.search(r':\s*(\d{3,4})$', sorted(labels)[0])
+    meta['wavelength'] = int(wavelength.group(1)) if wavelength is not None else None
+    if labels:
+        meta['labels'] = sorted(labels)
+    plate.attrs.update(meta)
+    return plate
+
+
+#The name used by the ELISA scripts for the GloMax exports
+read_glomax = read_plate
@@ -0,0 +1,373 @@
+"""
+ELISA standard curves
+
+fit_curve() fits the standard curve of a kit to the optical densities read on
+the standard wells, with one of the models
+
+    'linear', 'quadratic', 'cubic'    concentration as a polynomial of the OD,
+                                      least squares in closed form (the cubic
+                                      is the model recommended by the manufacturer)
+    '4pl'   OD = d + (a-d)/(1 + (x/c)^b)          four parameter logistic
+    '5pl'   OD = d + (a-d)/(1 + (x/c)^b)^g        five parameter logistic
+
+the logistic models being fitted iteratively by scipy.optimize.curve_fit
+(scipy is only imported for them) and inverted in closed form. The result is
+a StandardCurve, a function of an array of ODs giving the concentrations of
+all of them in one array operation:
+
+    curve = fit_curve(od, concentration, 'cubic', kit_lot='L2105', plate=name)
+    insulin = curve(plate_od)
+
+The curve knows the range of the ODs of its standards (od_range), outside
+which the concentration is extrapolated; valid() tells the ODs inside it and
+curve(od, outside='nan') or 'clip' leaves out or clips the others.
+
+For large numbers of reads (kinetic reads of many plates) the curve is also
+compiled by fit_curve() into a lookup table, CurveTable: the concentrations
+at knots across od_range, between which the concentration is interpolated
+linearly. The knots are placed adaptively, intervals being split until the
+interpolation is within tolerance of the analytic curve at CHECK_POINTS
+points inside every interval, and the largest difference found is kept as
+max_error, which is never above the tolerance. A curve that is not monotonic
+over od_range (a polynomial turning back between the standards), or whose
+table would need more than MAX_KNOTS knots, is not compiled: compile() raises
+ValueError, and fit_curve() warns and leaves the curve without a table, its
+concentrations being those of the fitted equation. lookup() converts any number of ODs with one
+np.interp pass (a binary search of the knots) and flags the ODs outside the
+range of the standards:
+
+    concentration, flags = curve.lookup(od)     <- flags: BELOW, IN_RANGE, ABOVE, NOT_READ
+
+curve(od) uses the table inside the range and the analytic curve outside it.
+The table is stored with the curve.
+
+CurveStore keeps the fitted curves as JSON files, one per kit lot and plate,
+so that the curve of a plate with standards is reused for the other plates
+of the same lot instead of being fitted again:
+
+    store = CurveStore()
+    store.save(curve)
+    curve = store.load('L2105')             <- the latest curve of the lot
+    curve = store.load('L2105', near=time)  <- the curve read closest to time
+
+The store is in Results/standard_curves at the root of the repository unless
+STANDARD_CURVES gives another location.
+"""
+
+import os
+import json
+import warnings
+import tempfile
+import datetime
+
+import numpy as np
+
+
+DEFAULT_ROOT = os.environ.get('STANDARD_CURVES', os.path.join(os.path.dirname(os.path.abspath(__file__)), '..',
+                                                                'Results', 'standard_curves'))
+
+POLYNOMIALS = {'linear': 1, 'quadratic': 2, 'cubic': 3}
+LOGISTICS = ('4pl', '5pl')
+
+#Largest error of the lookup tables against the analytic curve, as a fraction
+#of the concentration range of the standards
+TOLERANCE = 1e-4
+
+#Knots of a lookup table to start from and at most, and the points of every
+#interval at which the interpolation is checked against the analytic curve
+START_KNOTS = 65
+MAX_KNOTS = 1 << 16
+CHECK_POINTS = 16
+
+#Flags of lookup()
+BELOW, IN_RANGE, ABOVE, NOT_READ = -1, 0, 1, 2
+
+
+def _logistic(x, a, b, c, d, g=1.0):
+    return d+(a-d)/(1+(x/c)**b)**g
+
+
+def _4pl(x, a, b, c, d):
+    return _logistic(x, a, b, c, d)
+
+
+class CurveTable:
+
+    def __init__(self, od, concentration, tolerance, max_error):
+        self.od = np.asarray(od, dtype=np.float64)
+        self.concentration = np.asarray(concentration, dtype=np.float64)
+        self.tolerance = float(tolerance)
+        self.max_error = float(max_error)
+
+    #Interpolated concentration of ODs inside the table, NaN outside it
+    def __call__(self, od):
+        return np.interp(od, self.od, self.concentration, left=np.nan, right=np.nan)
+
+    def to_dict(self):
+        return {'od': self.od.tolist(), 'concentration': self.concentration.tolist(),
+                'tolerance': self.tolerance, 'max_error': self.max_error}
+
+    @classmethod
+    def from_dict(cls, entry):
+        return cls(entry['od'], entry['concentration'], entry['tolerance'], entry['max_error'])
+
+    def __len__(self):
+        return len(self.od)
+
+
+#Lookup table of the function f (vectorized) over [low, high], see the module
+#docstring. ValueError when f is not monotonic over the range (it could not
+#be inverted, and no table of its values would be), is not defined all over
+#it or cannot be brought within tolerance in MAX_KNOTS knots
+def compile_table(f, low, high, tolerance):
+    knots = np.linspace(low, high, START_KNOTS)
+    t = np.arange(1, CHECK_POINTS)/CHECK_POINTS
+    while True:
+        values = f(knots)
+        checks = knots[:-1,None]+t*np.diff(knots)[:,None]
+        exact = f(checks)
+        #The curve at the knots and the check points in order has to go one way only
+        od = np.append(np.column_stack([knots[:-1], checks]).ravel(), knots[-1])
+        points = np.append(np.column_stack([values[:-1], exact]).ravel(), values[-1])
+        if not np.isfinite(points).all():
+            raise ValueError('The curve is not defined over all of the OD range %.4g - %.4g' % (low, high))
+        signs = np.sign(np.diff(points))
+        signs = signs[signs != 0]
+        if len(signs) and (signs != signs[0]).any():
+            turn = np.flatnonzero(np.sign(np.diff(points)) == -signs[0])[0]
+            raise ValueError('The curve is not monotonic over the OD range %.4g - %.4g, it turns back at OD %.4g'
+                             % (low, high, od[turn]))
+        interpolated = values[:-1,None]+t*np.diff(values)[:,None]
+        error = np.abs(exact-interpolated).max(axis=1, initial=0.0)
+        split = error > tolerance
+        if not split.any():
+            return CurveTable(knots, values, tolerance, error.max(initial=0.0))
+        if len(knots)+split.sum() > MAX_KNOTS:
+            raise ValueError('The lookup table is still %.3g from the curve with %d knots, above the tolerance %.3g'
+                             % (error.max(), len(knots), tolerance))
+        knots = np.sort(np.concatenate([knots, (knots[:-1]+knots[1:])[split]/2]))
+
+
+class StandardCurve:
+
+    def __init__(self, model, params, od_range, concentration_range=None, kit_lot=None, plate=None,
+                 fitted=None, standards=None, table=None, read=None):
+        if model not in POLYNOMIALS and model not in LOGISTICS:
+            raise ValueError('Unknown standard curve model %r, use one of %s'
+                             % (model, ', '.join(list(POLYNOMIALS)+list(LOGISTICS))))
+        self.model = model
+        self.params = [float(p) for p in params]
+        self.od_range = tuple(float(x) for x in od_range)
+        self.concentration_range = tuple(float(x) for x in concentration_range) if concentration_range else None
+        self.kit_lot = kit_lot
+        self.plate = plate
+        self.fitted = fitted
+        self.standards = standards
+        self.table = table
+        self.read = read
+
+    #Lookup table of the curve within max_error of it (tolerance in concentration
+    #units, TOLERANCE of the concentration range by default), kept with the curve.
+    #ValueError from compile_table() when the curve cannot be tabulated
+    def compile(self, tolerance=None):
+        if tolerance is None:
+            span = np.ptp(self.concentration_range) if self.concentration_range else np.ptp(self.analytic(self.od_range))
+            tolerance = TOLERANCE*span if span > 0 else TOLERANCE
+        self.table = compile_table(self.analytic, self.od_range[0], self.od_range[1], tolerance)
+        return self.table
+
+    #Concentration of every OD, extrapolated outside od_range, NaN there with
+    #outside='nan' or taken at the nearest end of the range with outside='clip'.
+    #Inside the range the lookup table is used once compiled
+    def __call__(self, od, outside='extrapolate'):
+        od = np.asarray(od, dtype=np.float64)
+        if outside == 'clip':
+            od = np.clip(od, *self.od_range)
+        if outside not in ('extrapolate', 'nan', 'clip'):
+            raise ValueError('outside must be extrapolate, nan or clip, not %r' % outside)
+        if self.table is None:
+            concentration = self.analytic(od)
+        else:
+            concentration = self.table(od)
+            if outside == 'extrapolate':
+                #Only the few ODs outside the table go through the analytic curve
+                outside_table = np.isnan(concentration) & ~np.isnan(od)
+                if outside_table.any():
+                    concentration[outside_table] = self.analytic(od[outside_table])
+        if outside == 'nan':
+            concentration = np.where(self.valid(od), concentration, np.nan)
+        return concentration
+
+    #Concentration from the lookup table (compiled first if needed) and the flag of
+    #every OD: IN_RANGE, BELOW or ABOVE the range of the standards (NaN
+    #concentration) or NOT_READ. One pass over the ODs, whatever their number
+    def lookup(self, od):
+        if self.table is None:
+            self.compile()
+        od = np.asarray(od, dtype=np.float64)
+        flags = np.full(od.shape, IN_RANGE, np.int8)
+        with np.errstate(invalid='ignore'):
+            flags[od < self.od_range[0]] = BELOW
+            flags[od > self.od_range[1]] = ABOVE
+        flags[np.isnan(od)] = NOT_READ
+        return self.table(od), flags
+
+    #Concentration of every OD from the fitted equation of the model
+    def analytic(self, od):
+        od = np.asarray(od, dtype=np.float64)
+        if self.model in POLYNOMIALS:
+            concentration = np.polynomial.polynomial.polyval(od, self.params)
+        else:
+            a, b, c, d = self.params[:4]
+            g = self.params[4] if self.model == '5pl' else 1.0
+            #Inverse of the logistic: 0 for the ODs at or beyond the blank a, NaN
+            #at or beyond the saturation d
+            with np.errstate(divide='ignore', invalid='ignore'):
+                concentration = c*(((a-d)/(od-d))**(1/g)-1)**(1/b)
+                concentration = np.where((od-a)*(d-a) <= 0, 0.0, concentration)
+        return concentration
+
+    #ODs inside the range of the standards
+    def valid(self, od):
+        od = np.asarray(od, dtype=np.float64)
+        with np.errstate(invalid='ignore'):
+            return (od >= self.od_range[0]) & (od <= self.od_range[1])
+
+    #Equation of the curve, e.g. for the printout of ELISA.py
+    def equation(self):
+        if self.model in POLYNOMIALS:
+            return 'Con = '+' + '.join('%s*St^%d' % (p, k) if k > 1 else '%s*St' % p if k == 1 else str(p)
+                                       for k, p in enumerate(self.params))
+        params = ', '.join('%s = %s' % (name, p) for name, p in zip('abcdg', self.params))
+        return 'St = d + (a-d)/(1 + (Con/c)^b)%s, %s' % ('^g' if self.model == '5pl' else '', params)
+
+    def to_dict(self):
+        return {'model': self.model, 'params': self.params, 'od_range': list(self.od_range),
+                'concentration_range': list(self.concentration_range) if self.concentration_range else None,
+                'kit_lot': self.kit_lot, 'plate': self.plate, 'fitted': self.fitted, 'standards': self.standards,
+                'table': self.table.to_dict() if self.table is not None else None, 'read': self.read}
+
+    @classmethod
+    def from_dict(cls, entry):
+        table = CurveTable.from_dict(entry['table']) if entry.get('table') else None
+        return cls(entry['model'], entry['params'], entry['od_range'], entry.get('concentration_range'),
+                   entry.get('kit_lot'), entry.get('plate'), entry.get('fitted'), entry.get('standards'), table,
+                   entry.get('read'))
+
+    def __repr__(self):
+        return 'StandardCurve(%r, OD %.4g - %.4g, kit lot %s, plate %s)' % ((self.model,)+self.od_range+
+                                                                          (self.kit_lot, self.plate))
+
+
+#Standard curve of the model fitted to the ODs of the standards and their known
+#concentrations, the wells that were not read (NaN) being left out, with its
+#lookup table compiled to tolerance. read is the time of the read of the plate
+#(ISO format), by which CurveStore finds the curve closest to another plate
+def fit_curve(od, concentration, model='cubic', kit_lot=None, plate=None, tolerance=None, read=None):
+    od = np.asarray(od, dtype=np.float64)
+    concentration = np.asarray(concentration, dtype=np.float64)
+    finite = np.isfinite(od) & np.isfinite(concentration)
+    od, concentration = od[finite], concentration[finite]
+
+    if model in POLYNOMIALS:
+        degree = POLYNOMIALS[model]
+        if len(od) <= degree:
+            raise ValueError('%d standards for a %s standard curve' % (len(od), model))
+        #Least squares on the Vandermonde matrix, solved directly
+        params = np.linalg.lstsq(np.vander(od, degree+1, increasing=True), concentration, rcond=None)[0]
+    elif model in LOGISTICS:
+        from scipy.optimize import curve_fit
+        n = 4 if model == '4pl' else 5
+        if len(od) < n:
+            raise ValueError('%d standards for a %s standard curve' % (len(od), model))
+        #a: OD of the blank, d: OD at saturation, c: concentration at mid-range, b: slope
+        positive = concentration[concentration > 0]
+        guess = [od.min(), 1.0, np.median(positive) if len(positive) else 1.0, 2*od.max()-od.min()]
+        lower = [-np.inf, 1e-3, 1e-9, -np.inf]
+        upper = [np.inf, 20, np.inf, np.inf]
+        if model == '5pl':
+            guess, lower, upper = guess+[1.0], lower+[1e-3], upper+[20]
+        params = curve_fit(_4pl if model == '4pl' else _logistic, concentration, od, p0=guess,
+                           bounds=(lower, upper), maxfev=20000)[0]
+    else:
+        raise ValueError('Unknown standard curve model %r, use one of %s'
+                         % (model, ', '.join(list(POLYNOMIALS)+list(LOGISTICS))))
+
+    curve = StandardCurve(model, params, (od.min(), od.max()), (concentration.min(), concentration.max()),
+                          kit_lot, plate, datetime.datetime.now().isoformat(timespec='microseconds'),
+                          {'od': od.tolist(), 'concentration': concentration.tolist()}, read=read)
+    #A curve that turns back within the range of its standards keeps no table,
+    #its concentrations coming from the fitted equation
+    try:
+        curve.compile(tolerance)
+    except ValueError as err:
+        warnings.warn('No lookup table for the %s standard curve of %s: %s' % (model, plate, err))
+    return curve
+
+
+#Curve read closest to the time near (ISO format), the time of a curve being
+#that of the read of its plate, or of the fit when unknown. The latest curve
+#without near, None for no curves
+def closest_curve(curves, near=None):
+    if not curves:
+        return None
+    if near is None:
+        return max(curves, key=lambda curve: curve.fitted or '')
+    near = datetime.datetime.fromisoformat(near)
+    timed = [(curve, curve.read or curve.fitted) for curve in curves]
+    timed = [(curve, datetime.datetime.fromisoformat(time)) for curve, time in timed if time]
+    if not timed:
+        return max(curves, key=lambda curve: curve.fitted or '')
+    return min(timed, key=lambda entry: abs((entry[1]-near).total_seconds()))[0]
+
+
+def _file_name(text):
+    return ''.join(x if x.isalnum() or x in '-_. ' else '_' for x in str(text))
+
+
+class CurveStore:
+
+    def __init__(self, root=DEFAULT_ROOT):
+        self.root = os.path.normpath(root)
+        os.makedirs(self.root, exist_ok=True)
+
+    def _path(self, kit_lot, plate):
+        return os.path.join(self.root, _file_name(kit_lot), _file_name(plate)+'.json')
+
+    #Write the curve under its kit lot and plate, replacing an earlier fit
+    def save(self, curve):
+        if curve.kit_lot is None or curve.plate is None:
+            raise ValueError('The curve needs a kit lot and a plate to be stored')
+        path = self._path(curve.kit_lot, curve.plate)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(curve.to_dict(), f, indent=1)
+            os.replace(tmp, path)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        return path
+
+    #Curves of a kit lot, the latest fit first
+    def curves(self, kit_lot):
+        folder = os.path.join(self.root, _file_name(kit_lot))
+        if not os.path.isdir(folder):
+            return []
+        curves = []
+        for name in os.listdir(folder):
+            if name.endswith('.json'):
+                with open(os.path.join(folder, name)) as f:
+                    curves.append(StandardCurve.from_dict(json.load(f)))
+        return sorted(curves, key=lambda curve: curve.fitted or '', reverse=True)
+
+    #Curve of the plate, or when plate is None or has none the curve of the kit
+    #lot read closest to near (closest_curve()), the latest without near. None
+    #when the lot has no curve
+    def load(self, kit_lot, plate=None, near=None):
+        if plate is not None and os.path.exists(self._path(kit_lot, plate)):
+            with open(self._path(kit_lot, plate)) as f:
+                return StandardCurve.from_dict(json.load(f))
+        return closest_curve(self.curves(kit_lot), near)
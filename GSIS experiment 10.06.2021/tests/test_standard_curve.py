@@ -0,0 +1,43 @@
+import os
+import sys
+import warnings
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from standard_curve import fit_curve, compile_table, MAX_KNOTS
+
+OD = [0.1853862, 0.1905384, 0.211486, 0.3549538, 0.6754186, 1.193362]
+CONCENTRATION = [0, 0.197, 0.504, 1.54, 3.12, 6.72]
+
+
+@pytest.mark.parametrize('model', ['linear', 'quadratic', 'cubic', '4pl', '5pl'])
+def test_table_within_tolerance(model):
+    curve = fit_curve(OD, CONCENTRATION, model)
+    assert curve.table.max_error <= curve.table.tolerance
+    assert len(curve.table) <= MAX_KNOTS
+
+    od = np.linspace(*curve.od_range, 10001)
+    assert np.abs(curve(od)-curve.analytic(od)).max() <= curve.table.tolerance
+
+
+def test_non_monotonic_curve_is_not_compiled():
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter('always')
+        curve = fit_curve([.1, .2, .3, .4, .5], [.5, 0, .2, 1, 2], 'quadratic')
+    assert curve.table is None
+    assert any('not monotonic' in str(w.message) for w in caught)
+
+    #Without a table the concentrations are those of the fitted equation
+    od = np.linspace(*curve.od_range, 101)
+    np.testing.assert_array_equal(curve(od), curve.analytic(od))
+    with pytest.raises(ValueError, match='not monotonic'):
+        curve.compile()
+    with pytest.raises(ValueError, match='not monotonic'):
+        curve.lookup(od)
+
+
+def test_tolerance_out_of_reach():
+    with pytest.raises(ValueError, match='above the tolerance'):
+        compile_table(np.sqrt, 0.0, 1.0, 1e-12)
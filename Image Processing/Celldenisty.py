@@ -28,40 +28,83 @@ https://github.com/bnsreenu/python_for_microscopists/blob/master/033-grain_size_
 
 """
 
-import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
 
 import os.path
 import cv2
-from scipy import ndimage
-from skimage import measure, color, io
 
+from zstack import load_projection
+from cache import ResultCache
+from overlay import OverlayWriter, boundary_overlay, label_colours, shared_writer
+from labelstats import label_table
+from features import feature_table, write_features
+from profiling import NULL
 
-def celldensity(datapath,pixel_to_um=1.7, show=True):
 
-    img=cv2.imread(datapath)
+#Read the image to be analysed. For a confocal z-stack set projection to 'max',
+#'mean' or 'sum', the stack is then projected plane by plane instead
+def load_image(datapath, projection=None):
+    if projection is None:
+        img=cv2.imread(datapath)
+    else:
+        img=load_projection(datapath, projection)
+    if img is None:
+        raise IOError('Could not read the image '+datapath)
+    return img
+
+
+#OTSU threshold of one channel, never below min_threshold
+def otsu_level(dapi, min_threshold=0):
+    ret1, thresh=cv2.threshold(dapi, 0, 255, cv2.THRESH_BINARY+cv2.THRESH_OTSU)
+    return max(ret1, min_threshold)
 
-#pixel_to_um=1.7
+
+#Find the cells on one channel of the image (0 = blue) with OTSU thresholding and
+#the watershed. In the returned markers the background is 10, the cells are
+#numbered from 11 and the watershed boundaries are -1. min_threshold keeps OTSU
+#from splitting the noise of a channel that has (almost) no cells.
+#level and fg_level replace the OTSU threshold and the distance threshold
+#(fg_factor times the largest distance) when they have been worked out on a
+#larger image than the one given, as for the tiles of a mosaic
+def segment(img, channel=0, bg_kernel=2, bg_iterations=1, fg_factor=0.01, min_threshold=0, level=None, fg_level=None,
+            profiler=NULL):
 
     #Take the blue channel
-    dapi=img[:,:,0]
+    dapi=img[:,:,channel]
 
     #Threshold image to binary using OTSU. ALl thresholded pixels will be set to 255
-    ret1, thresh=cv2.threshold(dapi, 0, 255, cv2.THRESH_BINARY+cv2.THRESH_OTSU)
+    with profiler.stage('otsu'):
+        if level is None:
+            ret1, thresh=cv2.threshold(dapi, 0, 255, cv2.THRESH_BINARY+cv2.THRESH_OTSU)
+            if ret1<min_threshold:
+                ret1, thresh=cv2.threshold(dapi, min_threshold, 255, cv2.THRESH_BINARY)
+        else:
+            ret1, thresh=cv2.threshold(dapi, level, 255, cv2.THRESH_BINARY)
 
     #Create a working kernel matrix
-    kernel3 = np.ones((3,3),np.uint8)
-    kernel2 = np.ones((2,2),np.uint8)
+    kernel = np.ones((bg_kernel,bg_kernel),np.uint8)
 
     #Define a backgroud around the cells that is definitely not cells by using the function 'dilate'
-    sure_bg = cv2.dilate(thresh,kernel2,iterations=1)
+    with profiler.stage('dilate'):
+        sure_bg = cv2.dilate(thresh,kernel,iterations=bg_iterations)
 
     #Apply distance trasform method to the foreground. 
-    dist_transform = cv2.distanceTransform(thresh,cv2.DIST_L2,3)
+    with profiler.stage('distance_transform'):
+        dist_transform = cv2.distanceTransform(thresh,cv2.DIST_L2,3)
 
     #Threshold the distance transform
-    ret2, sure_fg = cv2.threshold(dist_transform,0.01*dist_transform.max(),255,0)
+    if fg_level is None:
+        fg_level=fg_factor*dist_transform.max()
+    with profiler.stage('watershed'):
+        return watershed_markers(img, sure_bg, dist_transform, fg_level)
+
+
+#The last stages of segment(), from the thresholded distance transform to the
+#watershed. Kept apart so that a parameter sweep can run them alone
+def watershed_markers(img, sure_bg, dist_transform, fg_level):
+
+    ret2, sure_fg = cv2.threshold(dist_transform,fg_level,255,0)
 
     #The unknown region is the difference between sure background and sure foreground
     sure_fg = np.uint8(sure_fg)
@@ -73,37 +116,80 @@ def celldensity(datapath,pixel_to_um=1.7, show=True):
     markers[unknown==255] = 0
     #plt.imshow(markers, cmap='jet')
 
-    #Perform the watershed to find the boundaries and color them yellow, excluding the borders of the image
+    #Perform the watershed to find the boundaries
     markers = cv2.watershed(img,markers)
-    for i in range(1,len(img)-1):
-        for j in range(1,len(img)-1):
-            if markers[i,j]==-1:
-                img[i,j]=[0,255,255]
-        
-        #img[markers == -1] = [0,255,255]  
-
-    #Produce an image with marked cells
-    img1 = color.label2rgb(markers, bg_label=0)
+    return markers
+
+
+#With a ResultCache given as cache, an image that has already been analysed with
+#the same parameters is not segmented again. With overlay set to a folder (or an
+#OverlayWriter) the control images are written there as 'png' or 'tif' by a
+#background thread, use it with show=False to run without any window. With
+#features set to a folder the table of the nuclei is saved there as parquet.
+#For mosaics too large to be segmented at once, tile sets the tile size of
+#tiled_segment() which then segments the image in parallel. A Profiler given as
+#profiler records the time and memory taken by every stage
+def celldensity(datapath,pixel_to_um=1.7, show=True, projection=None, bg_kernel=2, bg_iterations=1, fg_factor=0.01, cache=None,
+                overlay=None, overlay_format='png', features=None, tile=None, profiler=NULL):
+
+    profiler.image(datapath)
+
+    if cache is not None:
+        params={'pixel_to_um':pixel_to_um, 'projection':projection, 'bg_kernel':bg_kernel,
+                'bg_iterations':bg_iterations, 'fg_factor':fg_factor, 'tile':tile}
+        with profiler.stage('cache_lookup'):
+            key=cache.key(datapath, params)
+            hit=cache.get(key, full=features is not None)
+        if hit is not None:
+            if features is not None:
+                with profiler.stage('features'):
+                    write_features(feature_table(hit['regions'], pixel_to_um), datapath, features)
+            return hit['density']
+
+    with profiler.stage('imread'):
+        img=load_image(datapath, projection)
+
+#pixel_to_um=1.7
+
+    dapi=img[:,:,0]
+    if tile is None:
+        markers=segment(img, 0, bg_kernel, bg_iterations, fg_factor, profiler=profiler)
+    else:
+        from tiling import tiled_segment
+        with profiler.stage('tiled_segment'):
+            markers=tiled_segment(img, tile, channel=0, bg_kernel=bg_kernel, bg_iterations=bg_iterations, fg_factor=fg_factor)
+
+    #Color the boundaries yellow and the detected cells, then show or save them
+    if show==True or overlay is not None:
+        with profiler.stage('overlay'):
+            img0 = boundary_overlay(img, markers)
+            img1 = label_colours(markers)
+            if overlay is not None:
+                writer = overlay if isinstance(overlay, OverlayWriter) else shared_writer(overlay, overlay_format)
+                writer.submit(os.path.splitext(os.path.basename(datapath))[0], img0, img1)
     
-    #Extracting the properties of detected cells
-    regions = measure.regionprops(markers, intensity_image=dapi)
+    #Extracting the properties of detected cells, the background is left out
+    with profiler.stage('label_stats'):
+        regions = label_table(markers, intensity=dapi)
 
     #For cell density estimation, area is imortant
-    Areas=[]
-    for prop in regions:
-        Areas.append(prop.area)
-    #Remove the background area
-    Areas.pop(0)
-
-    Total_area=float(len(img)**2)
-    Cells_area=float(sum(Areas))
+    Total_area=float(img.shape[0]*img.shape[1])
+    Cells_area=float(regions['area'].sum())
 
     density_percent=100*Cells_area/Total_area
+
+    if cache is not None:
+        with profiler.stage('cache_store'):
+            cache.put(key, density_percent, markers, regions)
+
+    if features is not None:
+        with profiler.stage('features'):
+            write_features(feature_table(regions, pixel_to_um), datapath, features)
     
     #Show the original image and the colored cells that were found
     if show==True:
         cv2.destroyAllWindows()
-        cv2.imshow('Overlay on original image', img)
+        cv2.imshow('Overlay on original image', img0)
         cv2.imshow('Colored Grains', img1)
         cv2.waitKey(1000)
     
@@ -113,44 +199,51 @@ def celldensity(datapath,pixel_to_um=1.7, show=True):
 
 
 #%%
-cv2.destroyAllWindows()
-cv2.imshow('Overlay on original image', img)
-cv2.imshow('Colored Grains', img1)
-cv2.waitKey(0)
-
-#%%
-
-'''/Volumes/LaCie SSD/Leonid/Imaging/Stained/MIN6_density_2D_day4_1k.tif'''
-
-
-Cond=['2D','3D','3D_wb']
-Day=['day4','day5','day6','day7']
-Cell_conc=['1k', '2k', '5k', '10k', '20k', '50k', '100k', '200k','500k', '1M']
-
-Results={'Condition':[], 'Day':[], 'Cell concentration':[], 'Density':[]}
-
-common='/Volumes/LaCie SSD/Leonid/Imaging/Stained/MIN6_density_'
-
-for cond in Cond:
-    for day in Day:
-        for conc in Cell_conc:
-            if (cond=='2D' and (conc=='200k' or conc=='1M')) or ((cond=='3D' or cond=='3D_wb') and (conc=='1k' or conc=='2k' or conc== '5k' or conc=='20k')) or (cond=='3D_wb' and day!='day7'):
-                continue
-            datapath=common+cond+'_'+day+'_'+conc+'.tif'
-            density=celldensity(datapath,pixel_to_um=1.7, show=True)
-            Results['Condition'].append(cond)
-            Results['Day'].append(day)
-            Results['Cell concentration'].append(conc)
-            Results['Density'].append(density)
-            #print (cond,day,conc,density,'%')
-            
-Results_df=pd.DataFrame(Results)
-#%%
-plt.figure()
-plt.plot(np.arange(len(Day)),Results_df['Density'][(Results_df['Condition']=='2D')&(Results_df['Cell concentration']=='1k')]) 
-plt.xticks(np.arange(len(Day)),labels=Day)
-
-'''            
-datapath=common+'_'+Experiment['Condition']+'_'+Experiment['Day']+'_'+Experiment['Cell concentration']+'.tif'
-datapoint=Experiment['Condition']+'_'+Experiment['Day']+'_'+Experiment['Cell concentration']
-'''
+#The campaign is only run when the script is executed, so that the worker
+#processes of the batch engine can import celldensity() from this file
+
+if __name__ == '__main__':
+
+    import sys
+    from batch import run_batch
+    from library import ImageLibrary
+
+    #'/Volumes/LaCie SSD/Leonid/Imaging/Stained/MIN6_density_2D_day4_1k.tif'
+
+    Cond=['2D','3D','3D_wb']
+    Day=['day4','day5','day6','day7']
+    Cell_conc=['1k', '2k', '5k', '10k', '20k', '50k', '100k', '200k','500k', '1M']
+
+    #Only the images that exist are analysed, the index is refreshed for new files
+    library=ImageLibrary('/Volumes/LaCie SSD/Leonid/Imaging/Stained')
+    Paths=library.paths(condition=Cond, day=Day, concentration=Cell_conc)
+
+    #Segmentation results are kept on the SSD, only new or changed images are analysed again
+    cache=ResultCache('/Volumes/LaCie SSD/Leonid/Imaging/celldensity_cache')
+
+    #All the images are segmented in parallel, a corrupt file is reported in the 'Error' column
+    Results_df=run_batch(Paths, pixel_to_um=1.7, cache=cache, overlay='/Volumes/LaCie SSD/Leonid/Imaging/Overlays',
+                         features='/Volumes/LaCie SSD/Leonid/Imaging/Nuclei')
+
+    #The densities are kept in the result store shared with the other experiments,
+    #dated by the first image of the campaign and replacing those of an earlier run
+    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+    import datetime
+    from resultstore import ResultStore
+    Campaign_date=datetime.date.fromtimestamp(min(os.path.getmtime(p) for p in Paths))
+    ResultStore().append('density', Results_df[Results_df['Error'].isna()], experiment='MIN6 cell density',
+                         date=Campaign_date, mode='overwrite')
+
+    #Mean density of the replicate images of every condition with its bootstrap 95 % confidence interval,
+    #resampled over the replicates (an image read twice counts once), no interval for a single replicate
+    from bootstrap import bootstrap_table
+    Replicates_df=(Results_df[Results_df['Error'].isna()]
+                   .groupby(['Condition', 'Day', 'Cell concentration', 'Replicate'], as_index=False)['Density'].mean())
+    Density_df=bootstrap_table(Replicates_df, ['Condition', 'Day', 'Cell concentration'], 'Density', seed=0)
+    Density_df.insert(3, 'Replicates', Replicates_df.groupby(['Condition', 'Day', 'Cell concentration']).size().to_numpy())
+    print(Density_df.to_string(index=False))
+
+    #%%
+    plt.figure()
+    plt.plot(np.arange(len(Day)),Results_df['Density'][(Results_df['Condition']=='2D')&(Results_df['Cell concentration']=='1k')]) 
+    plt.xticks(np.arange(len(Day)),labels=Day)
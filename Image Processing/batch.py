@@ -0,0 +1,109 @@
+"""
+Batch cell density analysis
+
+Runs celldensity() over a whole imaging campaign in parallel. The images are
+spread across a pool of worker processes (one per core by default) and the
+results are streamed back in the order they finish, so that a long campaign
+can be followed while it runs. A file that cannot be read or segmented is
+recorded with its error message instead of stopping the batch.
+
+Images are expected to follow the naming convention of the density experiment:
+
+    MIN6_density_<condition>_<day>_<cell concentration>.tif
+
+e.g. MIN6_density_3D_wb_day7_100k.tif
+"""
+
+import os.path
+import glob
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+import cv2
+
+from Celldenisty import celldensity
+from library import parse_name, parse_replicate
+from profiling import Profiler
+
+
+#Turn a list of paths and/or glob patterns into a sorted list of files
+def expand_paths(paths):
+    if isinstance(paths, str):
+        paths = [paths]
+    files = []
+    for p in paths:
+        if glob.has_magic(p):
+            files.extend(glob.glob(p))
+        else:
+            files.append(p)
+    return sorted(set(files))
+
+
+def _init_worker():
+    #Every worker is given one core, OpenCV must not spawn its own threads on top
+    cv2.setNumThreads(1)
+
+
+def _process(func, datapath, kwargs, profile_alloc):
+    #The worker profiles with its own Profiler and sends the records back
+    profiler = None
+    if profile_alloc is not None:
+        profiler = Profiler(alloc=profile_alloc)
+        kwargs = dict(kwargs, profiler=profiler)
+    try:
+        result = datapath, func(datapath, **kwargs), None
+    except Exception as err:
+        result = datapath, None, '%s: %s' % (type(err).__name__, err)
+    return result, profiler.records if profiler is not None else None
+
+
+#Generator yielding (datapath, result, error) for every image as soon as it is done.
+#func is the analysis run on every image, celldensity() unless given otherwise.
+#With a Profiler as profiler, the stage records of all the workers are added to it
+def iter_batch(paths, workers=None, func=celldensity, profiler=None, **kwargs):
+    if func is celldensity:
+        kwargs['show'] = False
+    elif profiler is not None:
+        raise ValueError('Only celldensity() can be profiled')
+    profile_alloc = profiler.alloc if profiler is not None else None
+    files = expand_paths(paths)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = max(1, min(workers, len(files)))
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+        futures = {pool.submit(_process, func, f, kwargs, profile_alloc): f for f in files}
+        for future in as_completed(futures):
+            try:
+                result, records = future.result()
+            except Exception as err:
+                #The worker itself died (e.g. a crash in the TIFF decoder)
+                yield futures[future], None, '%s: %s' % (type(err).__name__, err)
+                continue
+            if records is not None:
+                profiler.extend(records)
+            yield result
+
+
+#Run the batch and collect the results into the Results table
+def run_batch(paths, workers=None, verbose=True, profiler=None, **kwargs):
+    Results = {'Condition':[], 'Day':[], 'Cell concentration':[], 'Replicate':[], 'Density':[], 'Path':[], 'Error':[]}
+
+    for datapath, density, error in iter_batch(paths, workers=workers, profiler=profiler, **kwargs):
+        cond, day, conc = parse_name(datapath)
+        Results['Condition'].append(cond)
+        Results['Day'].append(day)
+        Results['Cell concentration'].append(conc)
+        Results['Replicate'].append(parse_replicate(datapath))
+        Results['Density'].append(density)
+        Results['Path'].append(datapath)
+        Results['Error'].append(error)
+        if verbose:
+            if error is None:
+                print(cond, day, conc, round(density, 2), '%')
+            else:
+                print('Failed:', datapath, '-', error)
+
+    Results_df = pd.DataFrame(Results)
+    Results_df['Density'] = Results_df['Density'].astype(float)
+    return Results_df.sort_values('Path').reset_index(drop=True)
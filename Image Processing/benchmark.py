@@ -0,0 +1,148 @@
+"""
+Segmentation benchmark
+
+Measures how the segmentation behaves as the image size and the cell density
+grow, on synthetic fluorescent nuclei images whose ground truth is known.
+
+Every image is made of elliptical nuclei of random size, orientation and
+brightness drawn on the blue channel, blurred and with background noise added.
+The number of nuclei is set by the covered fraction of the image (density).
+The pipeline of celldensity() runs with a Profiler, and for every stage the
+wall time, the CPU time and the peak of memory allocated (tracemalloc, which
+also sees the arrays returned by OpenCV) are recorded. The accuracy against the
+ground truth is given as:
+
+    - density error, percentage points
+    - count error, % of the true number of nuclei
+    - F1 score of the nuclei matched by centroid within one mean radius
+    - foreground IoU (intersection over union of the cell pixels)
+
+The results are saved as JSON, one record per image, so that runs before and
+after a change of the segmentation can be compared:
+
+    python benchmark.py --sizes 512 2048 8192 --densities 0.02 0.1 0.3 --out bench.json
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import tracemalloc
+
+import numpy as np
+import cv2
+
+from Celldenisty import load_image, segment
+from labelstats import BACKGROUND, label_centroids, label_table
+from overlay import boundary_overlay, label_colours
+from tracking import match_points
+from profiling import Profiler
+
+
+#Synthetic image (8-bit BGR) and ground-truth labels (0 background, nuclei from 1)
+def synthetic_nuclei(size, density=0.1, radius=(5, 11), noise=20, seed=0):
+    rng = np.random.default_rng(seed)
+    mean_area = np.pi*np.mean(radius)**2
+    n = int(density*size*size/mean_area)
+
+    truth = np.zeros((size, size), np.int32)
+    signal = np.zeros((size, size), np.uint8)
+    centres = rng.integers(0, size, (n, 2))
+    axes = rng.integers(radius[0], radius[1]+1, (n, 2))
+    angles = rng.integers(0, 180, n)
+    brightness = rng.integers(120, 231, n)
+    for k in range(n):
+        centre = (int(centres[k,0]), int(centres[k,1]))
+        axis = (int(axes[k,0]), int(axes[k,1]))
+        cv2.ellipse(truth, centre, axis, int(angles[k]), 0, 360, k+1, -1)
+        cv2.ellipse(signal, centre, axis, int(angles[k]), 0, 360, int(brightness[k]), -1)
+
+    img = np.zeros((size, size, 3), np.uint8)
+    img[:,:,0] = cv2.GaussianBlur(signal, (5, 5), 0)
+    img = cv2.add(img, rng.integers(0, noise, img.shape, dtype=np.uint8))
+    return img, truth
+
+
+#Run the pipeline of celldensity() on one synthetic image and compare to the truth
+def run_case(size, density, seed=0, bg_kernel=2, bg_iterations=1, fg_factor=0.01):
+    img, truth = synthetic_nuclei(size, density, seed=seed)
+
+    fd, path = tempfile.mkstemp(suffix='.tif')
+    os.close(fd)
+    cv2.imwrite(path, img)
+    del img
+
+    tracemalloc.start()
+    profiler = Profiler(alloc=True)
+    profiler.image(path)
+    try:
+        t0 = time.perf_counter()
+        with profiler.stage('imread'):
+            img = load_image(path)
+        markers = segment(img, 0, bg_kernel, bg_iterations, fg_factor, profiler=profiler)
+        with profiler.stage('overlay'):
+            boundary_overlay(img, markers)
+            label_colours(markers)
+        with profiler.stage('label_stats'):
+            regions = label_table(markers, img[:,:,0])
+        total = time.perf_counter()-t0
+        peak = profiler.peak_bytes()
+    finally:
+        tracemalloc.stop()
+        os.remove(path)
+    stages = {r['stage']:{'wall_s':r['wall_s'], 'cpu_s':r['cpu_s'], 'peak_bytes':r['alloc_bytes']}
+              for r in profiler.records}
+
+    #Accuracy against the ground truth
+    cells = markers > BACKGROUND
+    true_cells = truth > 0
+    true_labels, true_area, true_centroids = label_centroids(truth+BACKGROUND)
+    found = np.stack([regions['centroid_row'], regions['centroid_col']], axis=1)
+    i, j = match_points(true_centroids, found, max_distance=8.0)
+    precision = len(j)/len(found) if len(found) else 0.0
+    recall = len(i)/len(true_labels) if len(true_labels) else 0.0
+
+    return {'size':size, 'density':density, 'seed':seed,
+            'true_nuclei':int(len(true_labels)), 'found_nuclei':int(len(found)),
+            'true_density':100*float(true_cells.mean()), 'found_density':100*float(cells.mean()),
+            'density_error_pp':100*float(cells.mean()-true_cells.mean()),
+            'count_error_percent':100*(len(found)-len(true_labels))/max(len(true_labels), 1),
+            'f1':2*precision*recall/(precision+recall) if precision+recall else 0.0,
+            'iou':float(np.count_nonzero(cells & true_cells)/max(np.count_nonzero(cells | true_cells), 1)),
+            'total_s':total, 'peak_bytes':peak, 'stages':stages}
+
+
+def run_suite(sizes=(512, 1024, 2048, 4096, 8192), densities=(0.02, 0.1, 0.3), repeat=1, verbose=True):
+    results = []
+    for size in sizes:
+        for density in densities:
+            for seed in range(repeat):
+                record = run_case(size, density, seed)
+                results.append(record)
+                if verbose:
+                    print('%5d px  density %.2f  %7d nuclei  %7.3f s  %7.1f MB  F1 %.3f' %
+                          (size, density, record['true_nuclei'], record['total_s'],
+                           record['peak_bytes']/2**20, record['f1']))
+    return results
+
+
+def save(results, out):
+    meta = {'python':sys.version.split()[0], 'numpy':np.__version__, 'opencv':cv2.__version__,
+            'platform':platform.platform(), 'processor':platform.processor(),
+            'date':time.strftime('%Y-%m-%d %H:%M:%S')}
+    with open(out, 'w') as f:
+        json.dump({'meta':meta, 'results':results}, f, indent=1)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark of the cell density segmentation')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[512, 1024, 2048, 4096, 8192])
+    parser.add_argument('--densities', type=float, nargs='+', default=[0.02, 0.1, 0.3])
+    parser.add_argument('--repeat', type=int, default=1)
+    parser.add_argument('--out', default='benchmark.json')
+    args = parser.parse_args()
+
+    save(run_suite(args.sizes, args.densities, args.repeat), args.out)
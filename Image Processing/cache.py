@@ -0,0 +1,114 @@
+"""
+Segmentation result cache
+
+Keeps the results of celldensity() on disk so that re-running a campaign only
+analyses the images that are new or have changed. An entry is keyed on the
+hash of the image file content together with the segmentation parameters, so
+renaming or moving a file does not invalidate it, while editing the image or
+changing a parameter does.
+
+Each entry is a compressed .npz file holding the density value, the label
+image (markers) and the region table. The total size of the cache is bounded:
+when it grows over max_bytes the least recently used entries are deleted.
+"""
+
+import os
+import json
+import hashlib
+import tempfile
+
+import numpy as np
+
+
+#Bump when the segmentation or the content of the entries changes, so that old entries are not reused
+CACHE_VERSION = 2
+
+
+class ResultCache:
+
+    def __init__(self, root, max_bytes=20*2**30):
+        self.root = root
+        self.max_bytes = max_bytes
+        os.makedirs(root, exist_ok=True)
+
+    #Hash of the file content plus the parameters that the result depends on
+    def key(self, datapath, params):
+        h = hashlib.blake2b(digest_size=20)
+        with open(datapath, 'rb') as f:
+            for chunk in iter(lambda: f.read(2**20), b''):
+                h.update(chunk)
+        h.update(json.dumps(params, sort_keys=True).encode())
+        h.update(str(CACHE_VERSION).encode())
+        return h.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.root, key+'.npz')
+
+    #Return {'density'} for a cached image, with the 'labels' and 'regions' table
+    #as well if full is True, or None if the image has not been analysed yet
+    def get(self, key, full=False):
+        path = self._path(key)
+        try:
+            with np.load(path) as entry:
+                hit = {'density': float(entry['density'])}
+                if full:
+                    hit['labels'] = entry['labels']
+                    hit['regions'] = {k[7:]: entry[k] for k in entry.files if k.startswith('region_')}
+        except (OSError, KeyError, ValueError):
+            return None
+        #Mark the entry as recently used
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return hit
+
+    def put(self, key, density, labels, regions):
+        arrays = {'density': np.float64(density), 'labels': np.asarray(labels, np.int32)}
+        for name, column in regions.items():
+            arrays['region_'+name] = np.asarray(column)
+
+        #Write to a temporary file first so that a parallel reader never sees half an entry
+        fd, tmp = tempfile.mkstemp(dir=self.root, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.savez_compressed(f, **arrays)
+            os.replace(tmp, self._path(key))
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        self.evict()
+
+    #Delete the least recently used entries until the cache fits in max_bytes
+    def evict(self):
+        entries = []
+        total = 0
+        with os.scandir(self.root) as it:
+            for e in it:
+                if not e.name.endswith('.npz'):
+                    continue
+                try:
+                    st = e.stat()
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, e.path))
+                total += st.st_size
+
+        if total <= self.max_bytes:
+            return
+        entries.sort()
+        for mtime, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                #Already removed by another worker
+                pass
+            total -= size
+
+    def clear(self):
+        for name in os.listdir(self.root):
+            if name.endswith('.npz'):
+                os.remove(os.path.join(self.root, name))
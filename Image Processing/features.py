@@ -0,0 +1,48 @@
+"""
+Nucleus feature table
+
+Per-nucleus measurements for every image, in physical units, computed from the
+label table of labelstats (bulk bincount reductions over the markers) rather
+than from measure.regionprops objects:
+
+    - Area, um^2 and the equivalent diameter of a disk of the same area, um
+    - Mean and integrated intensity on the Hoechst channel
+    - Centroid, um from the top left corner of the image
+
+pixel_to_um is the size of one pixel in um. The table of each image is written
+to <folder>/<image name>_nuclei.parquet, the files of a whole campaign can then
+be read back at once with pd.read_parquet(folder). The number of nuclei of an
+image is the number of rows of its table.
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+
+
+def feature_table(regions, pixel_to_um=1.7):
+    area = np.asarray(regions['area'], dtype=np.float64)
+    area_um2 = area*pixel_to_um**2
+
+    table = pd.DataFrame({
+        'Label': np.asarray(regions['label'], dtype=np.int32),
+        'Area px': area.astype(np.int64),
+        'Area um2': area_um2,
+        'Equivalent diameter um': np.sqrt(4*area_um2/np.pi),
+        'Centroid x um': np.asarray(regions['centroid_col'])*pixel_to_um,
+        'Centroid y um': np.asarray(regions['centroid_row'])*pixel_to_um})
+
+    if 'intensity_sum' in regions:
+        integrated = np.asarray(regions['intensity_sum'], dtype=np.float64)
+        table['Mean intensity'] = integrated/area
+        table['Integrated intensity'] = integrated
+    return table
+
+
+def write_features(table, datapath, folder):
+    os.makedirs(folder, exist_ok=True)
+    name = os.path.splitext(os.path.basename(datapath))[0]
+    table = table.assign(Image=name)
+    table['Image'] = table['Image'].astype('category')
+    table.to_parquet(os.path.join(folder, name+'_nuclei.parquet'), index=False)
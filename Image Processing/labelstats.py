@@ -0,0 +1,74 @@
+"""
+Label statistics
+
+Per-object measurements on the markers produced by segment(), computed in bulk
+with np.bincount over the label image instead of iterating over
+measure.regionprops objects. In the markers the background is 10, the cells
+are numbered from 11 and the watershed boundaries are -1.
+"""
+
+import numpy as np
+
+
+BACKGROUND = 10
+
+
+#Index of every cell pixel into the object arrays (label 11 -> 0) and the
+#number of label slots, flattened over the image
+def _cell_index(markers):
+    flat = markers.ravel()
+    cells = flat > BACKGROUND
+    n = max(int(flat.max())-BACKGROUND, 0)
+    return cells, flat[cells]-(BACKGROUND+1), n
+
+
+#Cell labels and their areas in pixels. Labels that the watershed has emptied are left out
+def label_areas(markers):
+    cells, idx, n = _cell_index(markers)
+    area = np.bincount(idx, minlength=n)
+    keep = area > 0
+    labels = np.arange(BACKGROUND+1, BACKGROUND+1+n)
+    return labels[keep], area[keep]
+
+
+#Sum of values (an image of the same size, or a mask) over every cell label,
+#in the same order as label_areas()
+def label_sums(markers, values):
+    cells, idx, n = _cell_index(markers)
+    area = np.bincount(idx, minlength=n)
+    sums = np.bincount(idx, weights=np.asarray(values).ravel()[cells], minlength=n)
+    return sums[area > 0]
+
+
+#Area, centroid and (with an intensity image) summed intensity of every cell
+#label in one pass. Returns a dict of columns, the background is left out
+def label_table(markers, intensity=None):
+    cells, idx, n = _cell_index(markers)
+    area = np.bincount(idx, minlength=n)
+    keep = area > 0
+
+    rows, cols = np.divmod(np.flatnonzero(cells), markers.shape[1])
+    table = {'label': np.arange(BACKGROUND+1, BACKGROUND+1+n)[keep],
+             'area': area[keep],
+             'centroid_row': np.bincount(idx, weights=rows, minlength=n)[keep]/area[keep],
+             'centroid_col': np.bincount(idx, weights=cols, minlength=n)[keep]/area[keep]}
+    if intensity is not None:
+        values = np.asarray(intensity).ravel()[cells]
+        table['intensity_sum'] = np.bincount(idx, weights=values, minlength=n)[keep]
+    return table
+
+
+#Labels, sizes and centroids of the cells of a label image of any dimension
+#(2D image or 3D stack). Centroids are an (n, ndim) array in pixel (voxel) units
+def label_centroids(markers):
+    cells, idx, n = _cell_index(markers)
+    size = np.bincount(idx, minlength=n)
+    keep = size > 0
+    coords = np.unravel_index(np.flatnonzero(cells), markers.shape)
+    centroids = np.stack([np.bincount(idx, weights=c, minlength=n)[keep] for c in coords], axis=1)/size[keep,None]
+    return np.arange(BACKGROUND+1, BACKGROUND+1+n)[keep], size[keep], centroids
+
+
+#Total cell area in pixels
+def cell_area(markers):
+    return int(np.count_nonzero(markers > BACKGROUND))
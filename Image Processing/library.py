@@ -0,0 +1,169 @@
+"""
+Image library
+
+Index of the images of the cell density experiment found under an image root.
+The condition, the day and the seeding concentration are read from the file
+names, which follow the convention
+
+    MIN6_density_<condition>_<day>_<cell concentration>[_<replicate>].tif
+
+e.g. MIN6_density_3D_wb_day7_100k.tif. Files that do not follow it are ignored.
+
+The index is saved as JSON in the image root (.min6_index.json) together with
+the modification time of every folder. A refresh only lists again the folders
+whose modification time has changed (a folder's mtime changes whenever a file
+is added, removed or renamed in it), the others are taken from the index. With
+thousands of images on an external SSD, a batch can therefore start from the
+index instead of walking the whole tree or guessing the paths:
+
+    lib = ImageLibrary('/Volumes/LaCie SSD/Leonid/Imaging/Stained')
+    lib.query(condition='3D', day='day7', min_cells=100e3)
+"""
+
+import os
+import re
+import json
+
+import pandas as pd
+
+
+INDEX_NAME = '.min6_index.json'
+INDEX_VERSION = 1
+
+NAME = re.compile(r'^MIN6_density_(?P<cond>.+)_(?P<day>day\d+)_(?P<conc>\d+(?:\.\d+)?[kM]?)(?:_(?P<rep>\d+))?\.tiff?$',
+                  re.IGNORECASE)
+
+UNITS = {'':1, 'k':10**3, 'M':10**6}
+
+
+#Condition, day and cell concentration of an image, or (None, None, None)
+def parse_name(datapath):
+    match = NAME.match(os.path.basename(datapath))
+    if match is None:
+        return None, None, None
+    return match.group('cond'), match.group('day'), match.group('conc')
+
+
+#Replicate number of an image (the image field of the condition), 1 when the
+#name has none
+def parse_replicate(datapath):
+    match = NAME.match(os.path.basename(datapath))
+    return int(match.group('rep')) if match is not None and match.group('rep') else 1
+
+
+#Number of cells per well of a concentration such as '500k' or '1M'
+def cells_per_well(conc):
+    conc = str(conc)
+    unit = conc[-1] if conc[-1] in 'kM' else ''
+    return int(round(float(conc[:len(conc)-len(unit)])*UNITS[unit]))
+
+
+def _parse_entry(name):
+    match = NAME.match(name)
+    if match is None:
+        return None
+    rep = match.group('rep')
+    return [name, match.group('cond'), match.group('day'), match.group('conc'),
+            cells_per_well(match.group('conc')), int(rep) if rep else 1]
+
+
+class ImageLibrary:
+
+    def __init__(self, root, refresh=True):
+        self.root = os.path.abspath(root)
+        self.index_path = os.path.join(self.root, INDEX_NAME)
+        self._dirs = {}
+        self._load()
+        if refresh:
+            self.refresh()
+
+    def _load(self):
+        try:
+            with open(self.index_path) as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            return
+        if index.get('version') == INDEX_VERSION:
+            self._dirs = index['dirs']
+
+    def _save(self):
+        tmp = self.index_path+'.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'version':INDEX_VERSION, 'dirs':self._dirs}, f)
+        os.replace(tmp, self.index_path)
+
+        #Saving the index has itself changed the mtime of the root. Record the new
+        #one, rewriting the file in place does not change it again
+        if '' in self._dirs:
+            self._dirs['']['mtime_ns'] = os.stat(self.root).st_mtime_ns
+            with open(self.index_path, 'w') as f:
+                json.dump({'version':INDEX_VERSION, 'dirs':self._dirs}, f)
+
+    #Bring the index up to date, listing only the folders that have changed.
+    #Returns the number of folders that were listed again
+    def refresh(self):
+        dirs = {}
+        listed = 0
+        stack = ['']
+        while stack:
+            rel = stack.pop()
+            path = os.path.join(self.root, rel)
+            try:
+                mtime = os.stat(path).st_mtime_ns
+            except OSError:
+                continue
+
+            entry = self._dirs.get(rel)
+            if entry is None or entry['mtime_ns'] != mtime:
+                files = []
+                subdirs = []
+                with os.scandir(path) as it:
+                    for e in it:
+                        if e.name.startswith('.'):
+                            continue
+                        if e.is_dir():
+                            subdirs.append(os.path.join(rel, e.name))
+                        elif e.is_file():
+                            parsed = _parse_entry(e.name)
+                            if parsed is not None:
+                                files.append(parsed)
+                entry = {'mtime_ns':mtime, 'files':sorted(files), 'subdirs':sorted(subdirs)}
+                listed += 1
+
+            dirs[rel] = entry
+            stack.extend(entry['subdirs'])
+
+        if listed or dirs.keys() != self._dirs.keys():
+            self._dirs = dirs
+            self._save()
+        return listed
+
+    #All the indexed images as a table
+    def table(self):
+        rows = [[os.path.join(self.root, rel, f[0])]+f[1:]
+                for rel, entry in self._dirs.items() for f in entry['files']]
+        table = pd.DataFrame(rows, columns=['Path', 'Condition', 'Day', 'Cell concentration', 'Cells', 'Replicate'])
+        table['Day number'] = table['Day'].str[3:].astype(int)
+        return table.sort_values(['Condition', 'Day number', 'Cells', 'Replicate']).reset_index(drop=True)
+
+    #Images matching all the given criteria, e.g. condition='3D', day='day7', min_cells=100e3.
+    #condition, day and concentration also accept lists
+    def query(self, condition=None, day=None, concentration=None, min_cells=None, max_cells=None):
+        table = self.table()
+        keep = pd.Series(True, index=table.index)
+        for column, value in (('Condition', condition), ('Day', day), ('Cell concentration', concentration)):
+            if value is None:
+                continue
+            if isinstance(value, (str, int)):
+                value = [value]
+            if column == 'Day':
+                value = [v if str(v).startswith('day') else 'day'+str(v) for v in value]
+            keep &= table[column].isin(value)
+        if min_cells is not None:
+            keep &= table['Cells'] >= min_cells
+        if max_cells is not None:
+            keep &= table['Cells'] <= max_cells
+        return table[keep].reset_index(drop=True)
+
+    def paths(self, **criteria):
+        return list(self.query(**criteria)['Path'])
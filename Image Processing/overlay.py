@@ -0,0 +1,133 @@
+"""
+Headless overlay rendering
+
+Produces the two control images of celldensity() - the original image with the
+watershed boundaries painted yellow and the image of the coloured cells - with
+whole-array operations, and writes them to disk from a background thread so
+that the analysis never waits for a window or for the image encoding.
+
+The images are written either as two PNG files (<name>_overlay.png and
+<name>_labels.png) or as one tiled multi-page TIFF (<name>_overlay.tif) with
+the overlay on the first page and the coloured cells on the second.
+"""
+
+import os
+import atexit
+import threading
+import queue
+from multiprocessing import util
+
+import numpy as np
+import cv2
+import tifffile
+from matplotlib.colors import to_rgb
+from skimage.color.colorlabel import DEFAULT_COLORS
+
+
+#Same colour cycle as skimage.color.label2rgb, in BGR for OpenCV
+_PALETTE = np.array([[round(255*c) for c in to_rgb(name)[::-1]] for name in DEFAULT_COLORS], np.uint8)
+
+
+#Paint the watershed boundaries (markers == -1) on a copy of the image,
+#excluding the borders of the image which the watershed always marks
+def boundary_overlay(img, markers, colour=(0,255,255)):
+    out = img.copy()
+    boundary = markers == -1
+    boundary[0,:] = boundary[-1,:] = False
+    boundary[:,0] = boundary[:,-1] = False
+    out[boundary] = colour
+    return out
+
+
+#Colour every label with the label2rgb colour cycle through a lookup table,
+#label 0 stays black. Returns an 8-bit BGR image
+def label_colours(markers, bg_label=0):
+    offset = -min(int(markers.min()), 0)
+    flat = markers.ravel()+offset if offset else markers.ravel()
+
+    #Rank of every label among the labels present, the background is skipped
+    present = np.bincount(flat, minlength=bg_label+offset+1) > 0
+    present[bg_label+offset] = False
+    rank = np.cumsum(present)-1
+
+    lut = _PALETTE[rank % len(_PALETTE)]
+    lut[~present] = 0
+    return lut[flat].reshape(markers.shape+(3,))
+
+
+class OverlayWriter:
+
+    def __init__(self, out_dir, fmt='png', max_pending=8):
+        if fmt not in ('png', 'tif'):
+            raise ValueError('Overlay format must be png or tif')
+        self.out_dir = out_dir
+        self.fmt = fmt
+        self.errors = []
+        os.makedirs(out_dir, exist_ok=True)
+
+        #A bounded queue keeps the memory in check if the disk is slower than the analysis.
+        #The thread is a daemon so that it never keeps the interpreter alive, close()
+        #draining the queue (at exit for shared_writer())
+        self._queue = queue.Queue(max_pending)
+        self._thread = threading.Thread(target=self._run, name='OverlayWriter', daemon=True)
+        self._thread.start()
+
+    def submit(self, name, overlay, labels):
+        if self._thread is None:
+            raise RuntimeError('OverlayWriter is closed')
+        self._queue.put((name, overlay, labels))
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            try:
+                self._write(*item)
+            except Exception as err:
+                self.errors.append((item[0], err))
+
+    def _write(self, name, overlay, labels):
+        base = os.path.join(self.out_dir, name)
+        if self.fmt == 'png':
+            for path, image in ((base+'_overlay.png', overlay), (base+'_labels.png', labels)):
+                if not cv2.imwrite(path, image):
+                    raise OSError('cv2.imwrite could not write '+path)
+        else:
+            pages = np.stack([overlay[:,:,::-1], labels[:,:,::-1]])
+            tile = (256,256) if min(overlay.shape[:2]) >= 256 else None
+            tifffile.imwrite(base+'_overlay.tif', pages, photometric='rgb', tile=tile, compression='zlib')
+
+    #Wait for the pending images to be written. The images that could not be
+    #written are reported and returned as (name, error)
+    def close(self):
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+            for name, err in self.errors:
+                print('Overlay not written:', name, '-', '%s: %s' % (type(err).__name__, err))
+        return self.errors
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+_writers = {}
+
+#One writer per output folder and process, closed when the process exits: by
+#atexit in the main process, by a multiprocessing finalizer in the batch workers
+#(which leave without running atexit). This is what celldensity() uses when it
+#is given a folder name
+def shared_writer(out_dir, fmt='png'):
+    key = (os.path.abspath(out_dir), fmt)
+    writer = _writers.get(key)
+    if writer is None:
+        writer = OverlayWriter(out_dir, fmt)
+        _writers[key] = writer
+        atexit.register(writer.close)
+        util.Finalize(writer, writer.close, exitpriority=10)
+    return writer
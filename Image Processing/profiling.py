@@ -0,0 +1,149 @@
+"""
+Pipeline profiling
+
+Opt-in instrumentation of celldensity(). Every stage of the pipeline (image
+read, OTSU, dilation, distance transform, watershed, overlay, label statistics,
+...) is timed for every image:
+
+    - wall time and CPU time (of the whole process, so OpenCV threads count)
+    - allocated bytes: the peak of memory traced by tracemalloc during the
+      stage, above what was allocated when it started (only with alloc=True,
+      tracemalloc slows the allocations down). Every stage resets the peak of
+      tracemalloc when it starts, so the peak reached before is first carried
+      over to the stages still open around it and to the peak of the whole run,
+      peak_bytes()
+
+A Profiler is passed to celldensity(profiler=...) or to run_batch(profiler=...),
+in which case the worker processes send their records back to it. The records
+are aggregated into a table per stage with summary(), per image and stage with
+per_image(), and can be saved as a Chrome trace (chrome://tracing or
+https://ui.perfetto.dev) with chrome_trace().
+
+Without a profiler the stages go through NULL, whose stage() returns one shared
+context manager that does nothing, so the instrumentation costs a method call
+per stage.
+"""
+
+import os
+import json
+import time
+import threading
+import tracemalloc
+
+import pandas as pd
+
+
+class _NullStage:
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class _NullProfiler:
+
+    _stage = _NullStage()
+
+    def stage(self, name):
+        return self._stage
+
+    def image(self, datapath):
+        pass
+
+
+NULL = _NullProfiler()
+
+
+class _Stage:
+
+    __slots__ = ('profiler', 'name', 'ts', 't0', 'cpu0', 'mem0', 'peak')
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        if self.profiler.alloc:
+            self.profiler._carry_peak()
+            tracemalloc.reset_peak()
+            self.mem0 = tracemalloc.get_traced_memory()[0]
+            self.peak = 0
+            self.profiler._open.append(self)
+        self.ts = time.time_ns()//1000
+        self.cpu0 = time.process_time()
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        wall = time.perf_counter()-self.t0
+        cpu = time.process_time()-self.cpu0
+        alloc = None
+        if self.profiler.alloc:
+            self.profiler._carry_peak()
+            self.profiler._open.remove(self)
+            alloc = self.peak-self.mem0
+        self.profiler.records.append({'image':self.profiler.current, 'stage':self.name, 'ts_us':self.ts,
+                                      'wall_s':wall, 'cpu_s':cpu, 'alloc_bytes':alloc,
+                                      'pid':os.getpid(), 'tid':threading.get_ident()})
+        return False
+
+
+class Profiler:
+
+    def __init__(self, alloc=False):
+        self.alloc = alloc
+        self.records = []
+        self.current = None
+        self.peak = 0
+        self._open = []
+        if alloc and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    #Peak traced since the last reset, into the open stages and the whole run
+    def _carry_peak(self):
+        peak = tracemalloc.get_traced_memory()[1]
+        for stage in self._open:
+            stage.peak = max(stage.peak, peak)
+        self.peak = max(self.peak, peak)
+
+    #Peak of memory traced over the whole run, whatever the stages reset (alloc=True)
+    def peak_bytes(self):
+        if self.alloc and tracemalloc.is_tracing():
+            self._carry_peak()
+        return self.peak
+
+    def stage(self, name):
+        return _Stage(self, name)
+
+    #Image the following stages belong to
+    def image(self, datapath):
+        self.current = os.path.basename(datapath)
+
+    def extend(self, records):
+        self.records.extend(records)
+
+    def table(self):
+        return pd.DataFrame(self.records, columns=['image', 'stage', 'ts_us', 'wall_s', 'cpu_s', 'alloc_bytes', 'pid', 'tid'])
+
+    #Count, total and mean wall time, CPU time and largest allocation per stage
+    def summary(self):
+        table = self.table()
+        summary = table.groupby('stage', sort=False).agg(
+            count=('wall_s', 'size'), wall_total_s=('wall_s', 'sum'), wall_mean_s=('wall_s', 'mean'),
+            cpu_total_s=('cpu_s', 'sum'), alloc_max_bytes=('alloc_bytes', 'max'))
+        summary['wall_percent'] = 100*summary['wall_total_s']/summary['wall_total_s'].sum()
+        return summary.sort_values('wall_total_s', ascending=False)
+
+    #Wall time of every stage (columns) for every image (rows)
+    def per_image(self, value='wall_s'):
+        return self.table().pivot_table(index='image', columns='stage', values=value, aggfunc='sum', sort=False)
+
+    def chrome_trace(self, path):
+        events = [{'name':r['stage'], 'cat':'celldensity', 'ph':'X', 'ts':r['ts_us'],
+                   'dur':r['wall_s']*1e6, 'pid':r['pid'], 'tid':r['tid'],
+                   'args':{'image':r['image'], 'cpu_s':r['cpu_s'], 'alloc_bytes':r['alloc_bytes']}}
+                  for r in self.records]
+        with open(path, 'w') as f:
+            json.dump({'traceEvents':events, 'displayTimeUnit':'ms'}, f)
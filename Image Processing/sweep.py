@@ -0,0 +1,96 @@
+"""
+Segmentation parameter sweep
+
+To choose the settings of segment() the density is worked out for a whole grid
+of parameters:
+
+    otsu_scale     - factor applied to the OTSU threshold
+    bg_kernel      - size of the dilation kernel of the sure background
+    bg_iterations  - number of dilations of the sure background
+    fg_factor      - distance threshold as a fraction of the largest distance
+
+Rather than running segment() again for every combination, the stages that
+only depend on a few of the parameters are worked out once per image and
+reused: the image read and the blue channel for all the grid, the binary image
+and the distance transform once per otsu_scale, and the sure background once
+per (otsu_scale, bg_kernel, bg_iterations). Only the tail of the pipeline
+(watershed_markers(): the distance threshold, the connected components and the
+watershed) runs for every grid point. The watershed takes most of the time of a
+single run, so the grid points of one image are run on parallel threads.
+
+The result is one table with a row per image and grid point, with the density
+and the number of cells found.
+"""
+
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+import cv2
+
+from Celldenisty import load_image, otsu_level, watershed_markers
+from labelstats import label_areas
+
+
+DEFAULT_GRID = {'otsu_scale':[1.0], 'bg_kernel':[2], 'bg_iterations':[1],
+                'fg_factor':[0.005, 0.01, 0.02, 0.05, 0.1]}
+
+
+def sweep_image(datapath, grid=None, channel=0, projection=None, threads=None):
+    grid = dict(DEFAULT_GRID, **(grid or {}))
+    names = ['otsu_scale', 'bg_kernel', 'bg_iterations', 'fg_factor']
+    points = list(itertools.product(*(grid[n] for n in names)))
+
+    img = load_image(datapath, projection)
+    dapi = img[:,:,channel]
+    level = otsu_level(dapi)
+    Total_area = float(img.shape[0]*img.shape[1])
+
+    #Binary image and distance transform, once per threshold
+    foreground = {}
+    for otsu_scale in set(p[0] for p in points):
+        ret, thresh = cv2.threshold(dapi, min(level*otsu_scale, 255), 255, cv2.THRESH_BINARY)
+        dist_transform = cv2.distanceTransform(thresh, cv2.DIST_L2, 3)
+        foreground[otsu_scale] = thresh, dist_transform, float(dist_transform.max())
+
+    #Sure background, once per threshold and dilation
+    background = {}
+    for otsu_scale, bg_kernel, bg_iterations in set(p[:3] for p in points):
+        kernel = np.ones((bg_kernel, bg_kernel), np.uint8)
+        background[otsu_scale, bg_kernel, bg_iterations] = cv2.dilate(foreground[otsu_scale][0], kernel, iterations=bg_iterations)
+
+    def tail(point):
+        otsu_scale, bg_kernel, bg_iterations, fg_factor = point
+        thresh, dist_transform, dist_max = foreground[otsu_scale]
+        markers = watershed_markers(img, background[point[:3]], dist_transform, fg_factor*dist_max)
+        labels, areas = label_areas(markers)
+        return {'otsu_scale':otsu_scale, 'bg_kernel':bg_kernel, 'bg_iterations':bg_iterations,
+                'fg_factor':fg_factor, 'Density':100*float(areas.sum())/Total_area, 'Cells':len(labels)}
+
+    #The watershed of every grid point is still the costly part, OpenCV releases
+    #the GIL so the points are shared between threads
+    if threads == 1:
+        rows = [tail(p) for p in points]
+    else:
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            rows = list(pool.map(tail, points))
+
+    table = pd.DataFrame(rows)
+    table.insert(0, 'Path', datapath)
+    return table
+
+
+#The same sweep on every image of a campaign, the images in parallel (one thread each)
+def sweep(paths, grid=None, workers=None, **kwargs):
+    from batch import iter_batch
+
+    tables = []
+    for datapath, table, error in iter_batch(paths, workers=workers, func=sweep_image, grid=grid, threads=1, **kwargs):
+        if error is not None:
+            print('Failed:', datapath, '-', error)
+            continue
+        tables.append(table)
+    if not tables:
+        return pd.DataFrame()
+    return pd.concat(tables, ignore_index=True).sort_values(['Path', 'otsu_scale', 'bg_kernel', 'bg_iterations', 'fg_factor']).reset_index(drop=True)
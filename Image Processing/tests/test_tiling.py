@@ -0,0 +1,33 @@
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from benchmark import synthetic_nuclei
+from Celldenisty import segment
+from labelstats import BACKGROUND
+from tiling import tiled_segment
+
+
+def _cells(markers):
+    return np.unique(markers[markers > BACKGROUND])
+
+
+def test_tiled_matches_untiled():
+    img, truth = synthetic_nuclei(768, density=0.15, seed=3)
+    whole = segment(img)
+    tiled = tiled_segment(img, tile=256, halo=32, workers=2)
+
+    n_whole, n_tiled = len(_cells(whole)), len(_cells(tiled))
+    assert abs(n_tiled-n_whole) <= 0.01*n_whole
+    assert abs(np.mean(tiled > BACKGROUND)-np.mean(whole > BACKGROUND)) < 0.001
+
+
+def test_tiles_do_not_overwrite_each_other():
+    #A halo smaller than the nuclei, so that the tiles disagree near the seams
+    img, truth = synthetic_nuclei(512, density=0.4, seed=5)
+    tiled = tiled_segment(img, tile=96, halo=24, workers=2)
+
+    #Every cell kept by a tile is still in the stitched image
+    assert len(_cells(tiled)) == tiled.max()-BACKGROUND
@@ -0,0 +1,182 @@
+"""
+Cross-day tracking
+
+The same wells were imaged every day from day 4 to day 7. Rather than keeping
+only the total density of each image, consecutive days of the same well
+(same condition, cell concentration and replicate) are registered and their
+nuclei matched, so that proliferation can be followed region by region.
+
+    1. Registration - the blue channel of both days is read downsampled and the
+       translation between them is found by FFT phase correlation (with a
+       sub-pixel parabolic refinement of the peak). All the pairs of the
+       campaign that have the same size are registered in one batched FFT.
+
+    2. Matching - the nuclei centroids of the first day, moved by the
+       registration shift, are matched to those of the next day by mutual
+       nearest neighbours within max_distance um (KD-tree queries).
+
+    3. Proliferation - the image is divided in a grid of regions, and the
+       number and area of the nuclei are counted per region on both days with
+       bincount. Proliferation is the relative change of the nuclei area of
+       the region, in percent.
+
+The nuclei come from the parquet tables written by celldensity(features=...)
+when they exist, otherwise the image is segmented again, so tracking costs at
+most one more segmentation pass over the campaign.
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+import cv2
+from scipy.spatial import cKDTree
+
+from Celldenisty import load_image, segment
+from labelstats import label_table
+from features import feature_table
+
+
+REDUCED = {1:cv2.IMREAD_COLOR, 2:cv2.IMREAD_REDUCED_COLOR_2, 4:cv2.IMREAD_REDUCED_COLOR_4, 8:cv2.IMREAD_REDUCED_COLOR_8}
+
+
+#Blue channel of an image read at 1/factor of its size, and the full size
+def downsampled(datapath, factor=4, channel=0):
+    img = cv2.imread(datapath, REDUCED[factor])
+    if img is None:
+        raise IOError('Could not read the image '+datapath)
+    return img[:,:,channel].astype(np.float32)
+
+
+#Translation (dy, dx) that moves the content of ref onto mov, for a stack of
+#image pairs of shape (n, H, W). Positions in mov are positions in ref + shift
+def phase_correlation(ref, mov):
+    ref = np.asarray(ref, np.float32)
+    mov = np.asarray(mov, np.float32)
+    n, h, w = ref.shape
+
+    #A Hann window keeps the image edges from dominating the correlation
+    window = np.outer(np.hanning(h), np.hanning(w)).astype(np.float32)
+    ref = (ref-ref.mean(axis=(1,2), keepdims=True))*window
+    mov = (mov-mov.mean(axis=(1,2), keepdims=True))*window
+
+    cross = np.fft.rfft2(mov)*np.conj(np.fft.rfft2(ref))
+    cross /= np.maximum(np.abs(cross), 1e-12)
+    corr = np.fft.irfft2(cross, s=(h, w))
+
+    flat = corr.reshape(n, -1).argmax(axis=1)
+    py, px = np.divmod(flat, w)
+    idx = np.arange(n)
+
+    #Parabolic refinement of the peak on both axes
+    def refine(c0, cm, cp):
+        denom = cm-2*c0+cp
+        return np.where(np.abs(denom) > 1e-12, 0.5*(cm-cp)/np.where(denom == 0, 1, denom), 0.0)
+
+    c0 = corr[idx, py, px]
+    dy = py+refine(c0, corr[idx, (py-1) % h, px], corr[idx, (py+1) % h, px])
+    dx = px+refine(c0, corr[idx, py, (px-1) % w], corr[idx, py, (px+1) % w])
+
+    #Peaks past the middle are negative shifts
+    dy = np.where(dy > h/2, dy-h, dy)
+    dx = np.where(dx > w/2, dx-w, dx)
+    return np.stack([dy, dx], axis=1)
+
+
+#Mutual nearest neighbours between two sets of points (n, 2). Returns the index
+#pairs (i in a, j in b) closer than max_distance
+def match_points(a, b, max_distance):
+    if len(a) == 0 or len(b) == 0:
+        return np.empty(0, int), np.empty(0, int)
+    dist_ab, ab = cKDTree(b).query(a, distance_upper_bound=max_distance)
+    dist_ba, ba = cKDTree(a).query(b, distance_upper_bound=max_distance)
+    i = np.flatnonzero(np.isfinite(dist_ab))
+    j = ab[i]
+    mutual = ba[j] == i
+    return i[mutual], j[mutual]
+
+
+#Nuclei table of an image: from the features folder if it is there, else segmented now
+def nuclei(datapath, features=None, pixel_to_um=1.7, projection=None):
+    if features is not None:
+        name = os.path.splitext(os.path.basename(datapath))[0]
+        path = os.path.join(features, name+'_nuclei.parquet')
+        if os.path.exists(path):
+            return pd.read_parquet(path)
+    img = load_image(datapath, projection)
+    return feature_table(label_table(segment(img), img[:,:,0]), pixel_to_um)
+
+
+#Counts, areas and matches of the nuclei of two days per region of a grid x grid division
+def region_proliferation(prev, nxt, shift_um, size_um, grid=4, max_distance=10.0):
+    p = prev[['Centroid x um', 'Centroid y um']].to_numpy()+shift_um[::-1]
+    q = nxt[['Centroid x um', 'Centroid y um']].to_numpy()
+    i, j = match_points(p, q, max_distance)
+
+    def region(points):
+        rx = np.clip((points[:,0]/size_um[1]*grid).astype(int), 0, grid-1)
+        ry = np.clip((points[:,1]/size_um[0]*grid).astype(int), 0, grid-1)
+        return ry*grid+rx
+
+    rp, rq = region(p), region(q)
+    n = grid*grid
+    table = pd.DataFrame({
+        'Region row': np.arange(n)//grid, 'Region col': np.arange(n) % grid,
+        'Count from': np.bincount(rp, minlength=n), 'Count to': np.bincount(rq, minlength=n),
+        'Area from um2': np.bincount(rp, weights=prev['Area um2'].to_numpy(), minlength=n),
+        'Area to um2': np.bincount(rq, weights=nxt['Area um2'].to_numpy(), minlength=n),
+        'Matched': np.bincount(rq[j], minlength=n)})
+    with np.errstate(divide='ignore', invalid='ignore'):
+        table['Proliferation'] = 100*(table['Area to um2']/table['Area from um2']-1)
+    return table
+
+
+#Track every well of a campaign, given as the table of an ImageLibrary (or a query of it)
+def track_campaign(images, features=None, pixel_to_um=1.7, factor=4, grid=4, max_distance=10.0):
+    images = images.sort_values('Day number')
+    pairs = []
+    for well, days in images.groupby(['Condition', 'Cell concentration', 'Replicate'], sort=True):
+        paths = list(days['Path'])
+        labels = list(days['Day'])
+        for k in range(len(paths)-1):
+            pairs.append((well, labels[k], labels[k+1], paths[k], paths[k+1]))
+    if not pairs:
+        return pd.DataFrame()
+
+    #Registration, one batched FFT per image size
+    small = {}
+    for pair in pairs:
+        for path in pair[3:]:
+            if path not in small:
+                small[path] = downsampled(path, factor)
+    shifts = np.zeros((len(pairs), 2))
+    by_shape = {}
+    for k, pair in enumerate(pairs):
+        h = min(small[pair[3]].shape[0], small[pair[4]].shape[0])
+        w = min(small[pair[3]].shape[1], small[pair[4]].shape[1])
+        by_shape.setdefault((h, w), []).append(k)
+    for (h, w), ks in by_shape.items():
+        ref = np.stack([small[pairs[k][3]][:h,:w] for k in ks])
+        mov = np.stack([small[pairs[k][4]][:h,:w] for k in ks])
+        shifts[ks] = phase_correlation(ref, mov)*factor*pixel_to_um
+
+    tables = []
+    cache = {}
+    for k, (well, day_from, day_to, path_from, path_to) in enumerate(pairs):
+        for path in (path_from, path_to):
+            if path not in cache:
+                cache[path] = nuclei(path, features, pixel_to_um)
+        size_um = np.array(small[path_from].shape)*factor*pixel_to_um
+        table = region_proliferation(cache[path_from], cache[path_to], shifts[k], size_um, grid, max_distance)
+        table.insert(0, 'Condition', well[0])
+        table.insert(1, 'Cell concentration', well[1])
+        table.insert(2, 'Replicate', well[2])
+        table.insert(3, 'Day from', day_from)
+        table.insert(4, 'Day to', day_to)
+        table.insert(5, 'Shift y um', shifts[k,0])
+        table.insert(6, 'Shift x um', shifts[k,1])
+        tables.append(table)
+        #The nuclei of the first day are not needed any more
+        cache.pop(path_from, None)
+
+    return pd.concat(tables, ignore_index=True)
@@ -0,0 +1,85 @@
+"""
+Live/dead cell analysis
+
+The cells were stained with Hoechst on the blue channel, which marks the nuclei
+of all the cells, and with draq7 on the red channel, which only enters the dead
+cells. Both channels are segmented from a single read of the image, then every
+Hoechst nucleus is checked against the draq7 signal:
+
+    - a nucleus is dead when at least overlap_threshold of its area is draq7
+      positive, otherwise it is live;
+    - draq7 objects that do not touch any nucleus are counted as dead cells
+      whose Hoechst signal has been lost.
+
+Live area is the area of the live nuclei and dead area the draq7 positive area,
+both as a percentage of the image and in um^2. Viability is the percentage of
+live cells among all the cells found.
+
+A well without dead cells leaves the red channel almost empty, so draq7 is only
+counted above dead_min_threshold (8-bit intensity) whatever OTSU finds.
+"""
+
+import numpy as np
+import pandas as pd
+
+from Celldenisty import load_image, segment
+from labelstats import BACKGROUND, label_areas, label_sums
+
+
+def livedead(datapath, pixel_to_um=1.7, projection=None, live_channel=0, dead_channel=2,
+             overlap_threshold=0.5, dead_min_threshold=25, bg_kernel=2, bg_iterations=1, fg_factor=0.01):
+
+    img = load_image(datapath, projection)
+
+    live = segment(img, live_channel, bg_kernel, bg_iterations, fg_factor)
+    dead = segment(img, dead_channel, bg_kernel, bg_iterations, fg_factor, dead_min_threshold)
+    live_mask = live > BACKGROUND
+    dead_mask = dead > BACKGROUND
+
+    #Fraction of every nucleus covered by draq7, and of every draq7 object covered by Hoechst
+    nuclei, nuclei_area = label_areas(live)
+    nuclei_overlap = label_sums(live, dead_mask)/nuclei_area
+    dead_objects, dead_objects_area = label_areas(dead)
+    dead_objects_overlap = label_sums(dead, live_mask)/dead_objects_area
+
+    is_dead = nuclei_overlap >= overlap_threshold
+    n_live = int(np.count_nonzero(~is_dead))
+    n_dead = int(np.count_nonzero(is_dead)+np.count_nonzero(dead_objects_overlap == 0))
+
+    Total_area = float(img.shape[0]*img.shape[1])
+    Live_area = float(nuclei_area[~is_dead].sum())
+    Dead_area = float(np.count_nonzero(dead_mask))
+
+    summary = {'Live cells':n_live, 'Dead cells':n_dead,
+               'Live area':100*Live_area/Total_area, 'Dead area':100*Dead_area/Total_area,
+               'Live area um2':Live_area*pixel_to_um**2, 'Dead area um2':Dead_area*pixel_to_um**2,
+               'Viability':100*n_live/(n_live+n_dead) if n_live+n_dead else np.nan}
+
+    objects = pd.concat([
+        pd.DataFrame({'Channel':'Hoechst', 'Label':nuclei, 'Area':nuclei_area,
+                      'Overlap':nuclei_overlap, 'Dead':is_dead}),
+        pd.DataFrame({'Channel':'draq7', 'Label':dead_objects, 'Area':dead_objects_area,
+                      'Overlap':dead_objects_overlap, 'Dead':True})],
+        ignore_index=True)
+    objects['Channel'] = objects['Channel'].astype('category')
+
+    return summary, objects
+
+
+#Only the summary, this is what the batch workers send back
+def viability(datapath, **kwargs):
+    return livedead(datapath, **kwargs)[0]
+
+
+#Viability of every image of a campaign, in parallel
+def viability_batch(paths, workers=None, **kwargs):
+    from batch import iter_batch, parse_name
+
+    rows = []
+    for datapath, summary, error in iter_batch(paths, workers=workers, func=viability, **kwargs):
+        cond, day, conc = parse_name(datapath)
+        row = {'Condition':cond, 'Day':day, 'Cell concentration':conc, 'Path':datapath, 'Error':error}
+        if summary is not None:
+            row.update(summary)
+        rows.append(row)
+    return pd.DataFrame(rows).sort_values('Path').reset_index(drop=True)
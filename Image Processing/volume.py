@@ -0,0 +1,151 @@
+"""
+Volumetric segmentation of confocal stacks
+
+In the 3D cultures the cells proliferate into the hydroscaffold, and cells lying
+above each other are merged when the stack is projected to 2D. Here the
+distance transform and the watershed are run on the stack itself and the
+density is reported as a volume fraction, together with the number of nuclei.
+
+The method follows segment() in three dimensions:
+
+    - OTSU threshold from the histogram of the whole stack (read plane by plane)
+    - Euclidean distance transform, with the z spacing of the planes taken
+      into account (z_step_um against pixel_to_um)
+    - sure foreground above fg_factor times the largest distance, labelled into
+      markers, and the sure background around the dilated binary stack
+    - watershed of the negative distance from the markers
+
+To bound the memory, the stack is cut into chunks of all the planes by
+chunk x chunk pixels, each extended by a halo, which the worker processes read
+straight from the file. Like the tiles of tiling.py, the largest distance is
+found in a first pass, and a chunk keeps the nuclei whose centroid lies in its
+core. The chunk size is worked out from memory_budget (bytes for all the
+workers together) unless it is given.
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from scipy import ndimage
+from skimage.filters import threshold_otsu
+from skimage.segmentation import watershed
+
+from zstack import iter_planes, stack_shape, read_region
+from labelstats import BACKGROUND, label_centroids
+
+
+#Approximate working memory per voxel of a chunk: the input, the binary stack,
+#the float64 distance transform, the markers and the watershed queues
+BYTES_PER_VOXEL = 48
+
+#The sure background is dilated within the planes only, as in 2D. The planes are
+#far apart and a dilation along z would add a whole plane to every nucleus
+IN_PLANE = ndimage.generate_binary_structure(3, 1)
+IN_PLANE[0] = IN_PLANE[2] = False
+
+
+#OTSU threshold of a whole stack from its histogram, accumulated plane by plane
+def stack_otsu(datapath, channel=0):
+    hist = None
+    for plane in iter_planes(datapath):
+        if plane.ndim == 3:
+            plane = plane[:,:,channel]
+        if plane.dtype.kind not in 'ui':
+            raise ValueError('Only integer stacks are supported')
+        counts = np.bincount(np.asarray(plane).ravel())
+        if hist is None:
+            hist = counts
+        else:
+            if len(counts) > len(hist):
+                counts[:len(hist)] += hist
+                hist = counts
+            else:
+                hist[:len(counts)] += counts
+    return float(threshold_otsu(hist=(hist, np.arange(len(hist)))))
+
+
+def chunk_size(n_planes, workers, memory_budget, halo):
+    voxels = memory_budget/(workers*BYTES_PER_VOXEL*n_planes)
+    return max(int(np.sqrt(voxels))-2*halo, 64)
+
+
+def _chunk_grid(shape, chunk, halo):
+    grid = []
+    for r0 in range(0, shape[0], chunk):
+        for c0 in range(0, shape[1], chunk):
+            r1 = min(r0+chunk, shape[0])
+            c1 = min(c0+chunk, shape[1])
+            pad = (max(r0-halo, 0), min(r1+halo, shape[0]), max(c0-halo, 0), min(c1+halo, shape[1]))
+            grid.append(((r0, r1, c0, c1), pad))
+    return grid
+
+
+def _distance(datapath, pad, channel, level, sampling):
+    block = read_region(datapath, pad[:2], pad[2:], channel)
+    binary = block > level
+    del block
+    return binary, ndimage.distance_transform_edt(binary, sampling=sampling)
+
+
+def _chunk_max_distance(datapath, core, pad, channel, level, sampling):
+    binary, dist = _distance(datapath, pad, channel, level, sampling)
+    r0, r1, c0, c1 = core[0]-pad[0], core[1]-pad[0], core[2]-pad[2], core[3]-pad[2]
+    return float(dist[:, r0:r1, c0:c1].max()) if dist.size else 0.0
+
+
+def _chunk_segment(datapath, core, pad, channel, level, sampling, fg_level, bg_iterations):
+    binary, dist = _distance(datapath, pad, channel, level, sampling)
+
+    #Markers as in segment(): background 10, cells from 11, unknown region 0
+    sure_fg = dist > fg_level
+    sure_bg = ndimage.binary_dilation(binary, structure=IN_PLANE, iterations=bg_iterations)
+    markers, n = ndimage.label(sure_fg)
+    markers = markers.astype(np.int32)+BACKGROUND
+    markers[sure_bg & ~sure_fg] = 0
+    del sure_fg, sure_bg
+
+    markers = watershed(-dist, markers)
+    del dist
+
+    #Nuclei whose centroid is in the core of the chunk, and the cell voxels of the core
+    r0, r1, c0, c1 = core[0]-pad[0], core[1]-pad[0], core[2]-pad[2], core[3]-pad[2]
+    labels, size, centroids = label_centroids(markers)
+    own = ((centroids[:,1] >= r0) & (centroids[:,1] < r1) &
+           (centroids[:,2] >= c0) & (centroids[:,2] < c1))
+    core_voxels = int(np.count_nonzero(markers[:, r0:r1, c0:c1] > BACKGROUND))
+    return core_voxels, size[own]
+
+
+#Volume fraction (%) and nuclei of a confocal z-stack
+def volumedensity(datapath, pixel_to_um=1.7, z_step_um=20.0, channel=0, fg_factor=0.01, bg_iterations=1,
+                  halo=32, chunk=None, workers=None, memory_budget=4*2**30):
+    n_planes, shape = stack_shape(datapath)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if chunk is None:
+        chunk = chunk_size(n_planes, workers, memory_budget, halo)
+    grid = _chunk_grid(shape, chunk, halo)
+    workers = max(1, min(workers, len(grid)))
+
+    level = stack_otsu(datapath, channel)
+    sampling = (z_step_um/pixel_to_um, 1.0, 1.0)
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        #First pass: the largest distance over the whole stack
+        futures = [pool.submit(_chunk_max_distance, datapath, core, pad, channel, level, sampling)
+                   for core, pad in grid]
+        fg_level = fg_factor*max(f.result() for f in futures)
+
+        futures = [pool.submit(_chunk_segment, datapath, core, pad, channel, level, sampling, fg_level, bg_iterations)
+                   for core, pad in grid]
+        results = [f.result() for f in futures]
+
+    cell_voxels = sum(r[0] for r in results)
+    sizes = np.concatenate([r[1] for r in results]) if results else np.empty(0)
+    voxel_um3 = pixel_to_um**2*z_step_um
+
+    return {'Volume fraction':100*cell_voxels/float(n_planes*shape[0]*shape[1]),
+            'Nuclei':int(len(sizes)),
+            'Mean nucleus volume um3':float(sizes.mean()*voxel_um3) if len(sizes) else np.nan,
+            'Planes':n_planes}
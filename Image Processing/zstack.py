@@ -0,0 +1,99 @@
+"""
+Z-stack projection
+
+The 3D hydroscaffold images are confocal z-stacks of 15-20 focal planes saved
+as multi-page TIFF files. Instead of loading the whole stack into memory, the
+planes are read one at a time (through a memory map when the TIFF is stored
+uncompressed and contiguously, otherwise page by page) and combined into a
+running max, mean or sum projection. The peak memory is then one plane plus
+the accumulator, whatever the number of planes or the size of the field.
+"""
+
+import numpy as np
+import tifffile
+
+
+#Yield the planes of a multi-page TIFF one after another
+def iter_planes(datapath):
+    with tifffile.TiffFile(datapath) as tif:
+        n_planes = len(tif.pages)
+
+        stack = None
+        if n_planes > 1:
+            try:
+                stack = tifffile.memmap(datapath, mode='r')
+            except ValueError:
+                #Compressed or scattered pages cannot be memory-mapped
+                stack = None
+            if stack is not None and stack.shape[0] != n_planes:
+                stack = None
+
+        if stack is not None:
+            for i in range(n_planes):
+                yield stack[i]
+        else:
+            for page in tif.pages:
+                yield page.asarray()
+
+
+#Number of planes and size (rows, columns) of the planes of a stack
+def stack_shape(datapath):
+    with tifffile.TiffFile(datapath) as tif:
+        return len(tif.pages), tif.pages[0].shape[:2]
+
+
+#Read the block rows x cols of every plane as one (planes, rows, cols) array.
+#Only that block is read from a memory-mapped stack, otherwise every page is
+#decoded and cropped in turn. For colour planes channel selects the channel
+def read_region(datapath, rows, cols, channel=0):
+    planes = []
+    for plane in iter_planes(datapath):
+        block = plane[rows[0]:rows[1], cols[0]:cols[1]]
+        if block.ndim == 3:
+            block = block[:,:,channel]
+        planes.append(np.array(block))
+    return np.stack(planes)
+
+
+#Combine the planes into a single 2D projection: 'max', 'mean' or 'sum'
+def project_stack(datapath, method='max'):
+    if method not in ('max', 'mean', 'sum'):
+        raise ValueError('Unknown projection method: '+str(method))
+
+    acc = None
+    n = 0
+    for plane in iter_planes(datapath):
+        if acc is None:
+            acc = np.array(plane, dtype=plane.dtype if method == 'max' else np.float64)
+        elif method == 'max':
+            np.maximum(acc, plane, out=acc)
+        else:
+            np.add(acc, plane, out=acc)
+        n += 1
+
+    if acc is None:
+        raise IOError('No image planes found in '+datapath)
+    if method == 'mean':
+        acc /= n
+    return acc
+
+
+#Convert a projection to the 8-bit BGR image that celldensity() works on.
+#A single-channel stack is taken to be the Hoechst channel and put on blue
+def to_bgr8(proj):
+    proj = np.asarray(proj)
+    if proj.dtype != np.uint8:
+        top = float(proj.max())
+        scale = 255.0/top if top > 0 else 0.0
+        proj = np.multiply(proj, scale, dtype=np.float32).astype(np.uint8)
+
+    if proj.ndim == 2:
+        img = np.zeros(proj.shape+(3,), np.uint8)
+        img[:,:,0] = proj
+        return img
+    #tifffile returns RGB, OpenCV expects BGR
+    return np.ascontiguousarray(proj[:,:,2::-1])
+
+
+def load_projection(datapath, method='max'):
+    return to_bgr8(project_stack(datapath, method))
@@ -21,28 +21,39 @@ import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
 import os.path
+import sys
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from resultstore import ResultStore, experiment_date
+from parsecache import cached
+from anton_paar import read_anton_paar, PARSER_VERSION
+from lve import lve_table, amplitude_sweep
+from bootstrap import bootstrap
 
-#Function rheoplot() takes the path to the txt file noted from Anton Paar
-#software and produces the plot of Storage and loss modulus vs strain
-def rheoplot(datapath, r_t_s, colour):
-    data = pd.read_csv(datapath, header=None, sep='\t', skiprows=r_t_s, usecols=range(1,6))
-    data=data.stack().str.replace(',','.').unstack()
-    data = data.astype(float)
-    data.columns =['Strain', 'Stress', 'Storage', 'Loss', 'Loss factor']
+
+#Function rheoplot() takes the path to the txt file exported from Anton Paar
+#software (the header and unit rows are found by read_anton_paar) and produces
+#the plot of Storage and loss modulus vs strain
+#The exports are parsed once, and loaded from the parse cache afterwards
+read_anton_paar = cached(read_anton_paar, PARSER_VERSION)
+
+def rheoplot(datapath, colour):
+    #The amplitude sweep among the intervals of the export
+    data = amplitude_sweep(read_anton_paar(datapath))
     plt.loglog(data['Strain'],data['Storage'], '-s', color=colour)
     plt.loglog(data['Strain'],data['Loss'], '--^', color=colour)
     plt.xlabel('Shear strain $\gamma$, %')
     plt.ylabel('Storage modulus G\', Pa \nLoss modulus G\", Pa')
-    Gp_max=np.amax(data['Storage'])
-    Gpp_max=np.amax(data['Loss'])
-    G=(Gp_max**2+Gpp_max**2)**(1/2)
+    #Moduli of the LVE plateau rather than the largest points of the sweep
+    LVE=lve_table([data]).iloc[0]
+    Gp_max=LVE['Storage modulus Pa']
+    Gpp_max=LVE['Loss modulus Pa']
+    G=LVE['Complex modulus Pa']
     return Gp_max,Gpp_max, G
     
 #%%
 folder=str(input('Enter the folder name: '))
 sampleset = str(input('Enter the file name: '))
-r_t_s=int(input('Rows to skip: '))
 n_of_samples=int(input('How many samples: '))
 plot_title = str(input('Enter the plot name: '))
 
@@ -60,7 +71,7 @@ for i in range(n_of_samples):
     filename=sampleset+'_'+str(i+1)+'.txt'
     datapath=os.path.abspath(folder+'/'+filename)
     colour='C'+str(i)
-    Gp_max, Gpp_max, G= rheoplot(datapath,r_t_s,colour)
+    Gp_max, Gpp_max, G= rheoplot(datapath,colour)
     Handles.append('Sample '+str(i+1)+' G\'')
     Handles.append('Sample '+str(i+1)+' G\"')
     print('\nLVR G\'=', Gp_max, 'Pa \nLVR G\"=', Gpp_max, 'Pa \nLVR G=',round(G,2),'Pa\n')
@@ -74,9 +85,18 @@ plt.legend(Handles,loc='best')
 #Obtain the mechanical properties
 mean_G=np.mean(Gt)
 error_G=np.std(Gt)
-print('Average shear elastic modulus =',round(mean_G,2),'±',round(error_G,2),'Pa\n')
+print('Average shear elastic modulus =',round(mean_G,2),'±',round(error_G,2),'Pa')
+#Bootstrap 95 % confidence interval of the mean, the samples being few
+_, low_G, high_G = bootstrap(Gt, 'mean', seed=0)
+print('95 % confidence interval =',round(low_G,2),'-',round(high_G,2),'Pa\n')
 
 E=3*mean_G
 print('Young\'s modulus =',round(E,2),'Pa','±',round(3*error_G,2),'Pa\n')
 
-roperties = {'G\'':Gp, 'G\"':Gpp, 'G':Gt, 'Average G':[mean_G,error_G],'E':[3*mean_G,3*error_G]}
+roperties = {'G\'':Gp, 'G\"':Gpp, 'G':Gt, 'Average G':[mean_G,error_G],'CI G':[low_G,high_G],'E':[3*mean_G,3*error_G]}
+
+#The moduli of every sample are added to the result store
+moduli = pd.DataFrame({'Sample set':sampleset, 'Sample':np.arange(1, n_of_samples+1),
+                       'Storage modulus Pa':Gp, 'Loss modulus Pa':Gpp, 'Complex modulus Pa':Gt})
+ResultStore().append('moduli', moduli, experiment=os.path.basename(os.path.abspath(folder)),
+                     date=experiment_date(os.path.abspath(folder)), mode='overwrite')
@@ -0,0 +1,222 @@
+'''
+Anton Paar rheometer exports
+
+Reader for the tab separated .txt tables exported by the Anton Paar software
+(RheoCompass) on the rheometer of the lab, which is set up in French:
+
+    Gap 100                                 <- optional notes typed before the export
+    Point No.  Déformation de Cisaillement  Contrainte de Cisaillement  ...  Etat
+                                            <- empty row
+               [1]                          [Pa]                        ...  [µN·m]
+    1          0,0648                       21,786                      ...  M- ,WE-,WMa
+
+The "Point No." header and the units row are found by the reader, so the
+number of rows to skip does not have to be known. The columns are renamed to
+short English names (COLUMNS), the numbers are parsed with the decimal comma
+straight into float arrays by the C parser of pandas, and the status of the
+measuring point (M- ,WE-,WMa ...), which takes a handful of values, is kept as a
+categorical column.
+
+A file can hold several intervals one after the other: the up and the down
+amplitude sweep under one header, the point number starting again from 1, or
+intervals of different tests (amplitude, frequency and time sweeps) each with
+its own header. iter_intervals() reads the file once and yields every
+interval as its own DataFrame as soon as its rows are read, with the test
+detected from the column that is swept (test_types()). read_anton_paar()
+returns them all in one DataFrame, numbered by the 'Interval' column.
+
+The units, the lines before the headers and the tests of the intervals are
+kept in the attrs of the DataFrame ('units', 'notes', 'tests').
+'''
+
+import io
+import re
+
+import numpy as np
+import pandas as pd
+
+
+#Column names of the exports (French and English software) and their short names.
+#The accents are matched loosely as the exports are not always Latin-1
+COLUMNS = [(r'^point', 'Point'),
+           (r'^d.formation|^shear strain|^strain', 'Strain'),
+           (r'^contrainte|^shear stress|^stress', 'Stress'),
+           (r'^module de stockage|^storage modulus', 'Storage'),
+           (r'^module de perte|^loss modulus', 'Loss'),
+           (r'^facteur de perte|^loss factor|^damping factor', 'Loss factor'),
+           (r'^fr.quence angulaire|^angular frequency', 'Angular frequency'),
+           (r'^fr.quence|^frequency', 'Frequency'),
+           (r'^temps|^time|^interval time', 'Time'),
+           (r'^temp.rature|^temperature', 'Temperature'),
+           (r'^viscosit. complexe|^complex viscosity', 'Complex viscosity'),
+           (r'^module complexe|^complex (shear )?modulus', 'Complex modulus'),
+           (r'^couple|^torque', 'Torque'),
+           (r'^force normale|^normal force', 'Normal force'),
+           (r'^.tat|^status', 'Status')]
+
+ENCODING = 'latin-1'
+
+#Bump when the output of the reader changes, so that the parse cache is refreshed
+PARSER_VERSION = 3
+
+#An interval whose strain (or frequency) spans more than this ratio is a sweep of it
+SWEEP_RATIO = 2.0
+
+
+def english_name(name):
+    key = name.strip().lower()
+    for pattern, short in COLUMNS:
+        if re.match(pattern, key):
+            return short
+    return name.strip()
+
+
+def _units(names, line):
+    return {name: unit.strip().strip('[]') for name, unit in zip(names, line.rstrip('\r\n').split('\t'))
+            if name and unit.strip()}
+
+
+#Largest over smallest absolute non-zero value of x in every interval, the
+#intervals starting at the indices starts
+def _spans(x, starts):
+    x = np.abs(x)
+    x[x == 0] = np.nan
+    with np.errstate(invalid='ignore', divide='ignore'):
+        span = np.fmax.reduceat(x, starts)/np.fmin.reduceat(x, starts)
+    return np.where(np.isfinite(span), span, 1.0)
+
+
+#Test of the intervals of a block from what varies in them: 'amplitude sweep',
+#'frequency sweep', 'time sweep' or 'unknown'
+def test_types(data, starts):
+    tests = np.full(len(starts), 'time sweep' if 'Time' in data else 'unknown', dtype=object)
+    if 'Time' not in data:
+        #Without a time column, an interval of several points varying in neither is a time sweep
+        tests[np.diff(np.append(starts, len(data))) > 1] = 'time sweep'
+    decided = np.zeros(len(starts), bool)
+    #The stress only tells an amplitude sweep without a strain column: at a fixed
+    #strain it rises by itself as a sample sets (a gelation time sweep)
+    for column, test in (('Angular frequency', 'frequency sweep'), ('Frequency', 'frequency sweep'),
+                         ('Strain', 'amplitude sweep'), ('Stress', 'amplitude sweep')):
+        if column == 'Stress' and 'Strain' in data:
+            continue
+        if column in data:
+            sweep = ~decided & (_spans(data[column].to_numpy(np.float64), starts) > SWEEP_RATIO)
+            tests[sweep] = test
+            decided |= sweep
+    return tests
+
+
+def test_type(data):
+    return test_types(data, np.array([0]))[0] if len(data) else 'unknown'
+
+
+#Rows under one header parsed in one go, with the start of every interval in
+#them: the point number starting again from 1 without a new header starts a
+#new interval
+def _parse_block(lines, names):
+    dtype = {name: np.float64 for name in names}
+    if 'Status' in dtype:
+        dtype['Status'] = 'category'
+    data = pd.read_csv(io.StringIO(''.join(lines)), sep='\t', header=None, names=names,
+                       usecols=range(len(names)), decimal=',', dtype=dtype, engine='c')
+    data = data[data['Point'].notna()].reset_index(drop=True)
+    point = data['Point'].to_numpy()
+    data['Point'] = point.astype(np.int32)
+    starts = np.concatenate([[0], np.flatnonzero(np.diff(point) <= 0)+1]) if len(point) else np.empty(0, int)
+    return data, starts
+
+
+#Yield (rows, interval starts, units, notes) for every header of an export,
+#in a single pass over the file
+def _iter_blocks(datapath):
+    names = None
+    units = {}
+    notes = []
+    lines = []
+
+    with open(datapath, encoding=ENCODING, newline='') as f:
+        for line in f:
+            if line[:1].isdigit():
+                if names is None:
+                    raise ValueError('Data before the "Point No." header in '+datapath)
+                lines.append(line)
+                continue
+
+            #Header, units, empty or note lines end the rows of the current block
+            if lines:
+                yield _parse_block(lines, names)+(units, notes)
+                lines = []
+                notes = []
+
+            first = line.split('\t', 1)[0].strip()
+            if first.lower().startswith('point'):
+                names = [english_name(x) for x in line.rstrip('\r\n').split('\t')]
+                #The trailing tab of the rows adds an unnamed empty column
+                while names and not names[-1]:
+                    names.pop()
+                units = {}
+            elif not line.strip():
+                continue
+            elif names is not None and not first and '[' in line:
+                units = dict(units, **_units(names, line))
+            else:
+                notes.append(line.strip())
+
+    if lines:
+        yield _parse_block(lines, names)+(units, notes)
+    elif names is None:
+        raise ValueError('No "Point No." header found in '+datapath)
+
+
+#Yield the intervals of an export one at a time, in a single pass over the file.
+#Every interval comes with its own header ("Point No." row and units) or follows
+#the previous one under the same header, the point number starting again. Each
+#is a DataFrame of float columns (Point as int, Status as categorical) with its
+#number, its detected test type, its units and the notes before it in attrs
+def iter_intervals(datapath):
+    number = 1
+    for data, starts, units, notes in _iter_blocks(datapath):
+        tests = test_types(data, starts)
+        ends = np.append(starts[1:], len(data))
+        for k in range(len(starts)):
+            interval = data.iloc[starts[k]:ends[k]].reset_index(drop=True)
+            interval.attrs = {'interval': number, 'test': str(tests[k]), 'units': units,
+                              'notes': notes if k == 0 else []}
+            yield interval
+            number += 1
+
+
+#All the intervals of an export in one DataFrame, numbered in the 'Interval'
+#column. The test of each interval is in attrs['tests'], in the order of the intervals
+def read_anton_paar(datapath):
+    blocks = []
+    attrs = {'units': {}, 'notes': [], 'tests': []}
+    number = 1
+    for data, starts, units, notes in _iter_blocks(datapath):
+        counts = np.diff(np.append(starts, len(data)))
+        data.insert(0, 'Interval', np.repeat(np.arange(number, number+len(starts), dtype=np.int32), counts))
+        attrs['tests'].extend(test_types(data, starts).tolist())
+        attrs['units'].update(units)
+        attrs['notes'].extend(notes)
+        number += len(starts)
+        blocks.append(data)
+
+    if not blocks:
+        raise ValueError('No data points under the header in '+datapath)
+    data = pd.concat(blocks, ignore_index=True) if len(blocks) > 1 else blocks[0]
+    if 'Status' in data and not isinstance(data['Status'].dtype, pd.CategoricalDtype):
+        data['Status'] = data['Status'].astype('category')
+    data.attrs = attrs
+    return data
+
+
+#The intervals of a DataFrame of read_anton_paar() (e.g. loaded from the parse
+#cache) as iter_intervals() yields them
+def split_intervals(data):
+    tests = data.attrs.get('tests', [])
+    for number, interval in data.groupby('Interval', sort=True):
+        interval = interval.drop(columns='Interval').dropna(axis=1, how='all').reset_index(drop=True)
+        interval.attrs = {'interval': int(number), 'test': tests[number-1] if number <= len(tests) else 'unknown',
+                          'units': data.attrs.get('units', {}), 'notes': []}
+        yield interval
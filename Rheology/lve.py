@@ -0,0 +1,153 @@
+'''
+Linear viscoelastic range of amplitude sweeps
+
+The largest G' of a sweep is not the modulus of the linear viscoelastic (LVE)
+range: the first points are measured while the rheometer is still settling
+(292 Pa at point 1 of onco24_1 against about 260 Pa after it). Here the LVE
+range is the plateau of G' at the start of the sweep:
+
+    - the first skip points are left out
+    - the LVE range ends at the first point where G' has fallen more than
+      tolerance (5 % by default) below the highest G' reached before it, so a
+      G' that still rises at the start of the sweep, as the gel settles under
+      the first oscillations, stays in the range; the critical strain is where
+      the fall reaches the tolerance, interpolated between the last point in
+      the range and the first point out of it on log-log axes
+    - G' and G" of the LVE range are their means over the points in the range
+    - the flow point is the G'/G" crossover, the strain at which log G' - log G"
+      goes through zero, interpolated on log-log axes, with the modulus there
+
+Nothing is computed per sample in Python: the sweeps are stacked into
+(samples, points) arrays padded with NaN, and every quantity is worked out
+for all the samples and points at once, so hundreds of sweeps are analysed in
+one pass over the arrays. Values that do not exist (no departure within the
+sweep, G" above G' from the start) are NaN.
+'''
+
+import numpy as np
+import pandas as pd
+
+
+AMPLITUDE_SWEEP = 'amplitude sweep'
+
+
+#Rows of the first amplitude sweep of an export of read_anton_paar() (the up
+#sweep), found by the test detected for every interval (attrs['tests']), so that
+#a frequency or time sweep exported before it is not taken for it. A DataFrame
+#without intervals or tests is taken as one sweep. ValueError when the export
+#has no amplitude sweep
+def amplitude_sweep(data):
+    tests = list(data.attrs.get('tests', []))
+    if not tests or 'Interval' not in data:
+        return data
+    if AMPLITUDE_SWEEP not in tests:
+        raise ValueError('No amplitude sweep among the intervals of the export (%s)' % ', '.join(tests))
+    return data[data['Interval'].to_numpy() == tests.index(AMPLITUDE_SWEEP)+1]
+
+
+#Swept variable x (the strain), G' and G" of the sweeps stacked into (samples,
+#points) arrays padded with NaN. Only the first amplitude sweep of each export
+#is used by default, the interval of the given number with an int, all of it
+#with interval=None
+def stack_sweeps(sweeps, interval=AMPLITUDE_SWEEP, x='Strain'):
+    parts = []
+    for data in sweeps:
+        if interval == AMPLITUDE_SWEEP:
+            data = amplitude_sweep(data)
+        elif 'Interval' in data and interval is not None:
+            data = data[data['Interval'].to_numpy() == interval]
+        values = np.column_stack([data[x].to_numpy(np.float64), data['Storage'].to_numpy(np.float64),
+                                  data['Loss'].to_numpy(np.float64)])
+        parts.append(values)
+    m = max((len(p) for p in parts), default=0)
+    arrays = np.full((3, len(parts), m), np.nan)
+    for i, p in enumerate(parts):
+        arrays[:, i, :len(p)] = p.T
+    return arrays[0], arrays[1], arrays[2]
+
+
+#Index of the first True along the rows at or after start, -1 when there is none
+def first_true(mask, start):
+    mask = np.array(mask)
+    mask[:, :start] = False
+    k = mask.argmax(axis=1)
+    return np.where(mask.any(axis=1), k, -1)
+
+
+#Position between the points k-1 and k where y (one value per point) goes
+#through zero, as a fraction t, and x interpolated there
+def zero_crossing(x, y, k):
+    rows = np.arange(len(k))
+    k = np.maximum(k, 1)
+    x0, x1 = x[rows, k-1], x[rows, k]
+    y0, y1 = y[rows, k-1], y[rows, k]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = np.clip(np.where(y0 != y1, y0/(y0-y1), 0.0), 0.0, 1.0)
+    return t, x0+t*(x1-x0)
+
+
+#Value of x and modulus where G" goes above G' (or G' above G" with rising=True),
+#interpolated on log-log axes from the log10 arrays. NaN when the moduli do not
+#cross after the point start, or are already crossed there
+def crossover(log_x, log_storage, log_loss, start=0, rising=False):
+    rows = np.arange(len(log_x))
+    ratio = log_storage-log_loss if not rising else log_loss-log_storage
+    with np.errstate(invalid='ignore'):
+        crossed = ratio <= 0
+    k = first_true(crossed, start)
+    found = k > start
+    t, log_at = zero_crossing(log_x, np.where(np.isfinite(ratio), ratio, 0), k)
+    k = np.maximum(k, 1)
+    log_modulus = log_storage[rows, k-1]+t*(log_storage[rows, k]-log_storage[rows, k-1])
+    return np.where(found, 10**log_at, np.nan), np.where(found, 10**log_modulus, np.nan)
+
+
+#LVE range of the stacked sweeps. Returns a dict of arrays, one value per sample
+def lve(strain, storage, loss, tolerance=0.05, skip=1):
+    strain = np.atleast_2d(strain)
+    storage = np.atleast_2d(storage)
+    loss = np.atleast_2d(loss)
+    m = storage.shape[1]
+    points = np.arange(m)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        log_strain = np.log10(strain)
+        log_storage = np.log10(storage)
+        log_loss = np.log10(loss)
+
+    #Highest G' so far and the first point falling below it by more than tolerance
+    peak = np.fmax.accumulate(np.where(points >= skip, storage, np.nan), axis=1)
+    with np.errstate(invalid='ignore'):
+        deviation = 1-storage/peak-tolerance
+        departed = deviation > 0
+    critical = first_true(departed, skip)
+
+    #Points of the LVE range: from skip up to the departure, or to the end of the sweep
+    end = np.where(critical >= 0, critical, m)
+    in_range = (points >= skip) & (points < end[:,None]) & np.isfinite(storage)
+    count = in_range.sum(axis=1)
+    with np.errstate(invalid='ignore'):
+        storage_lve = np.where(in_range, storage, 0).sum(axis=1)/count
+        loss_lve = np.where(in_range, loss, 0).sum(axis=1)/count
+
+    has_range = (critical > skip) & (count > 0)
+    t, log_critical = zero_crossing(log_strain, np.where(np.isfinite(deviation), deviation, 0), critical)
+    critical_strain = np.where(has_range, 10**log_critical, np.nan)
+
+    #Flow point: first point from skip with G" >= G'
+    flow_strain, flow_modulus = crossover(log_strain, log_storage, log_loss, skip)
+
+    return {'Storage modulus Pa': np.where(count > 0, storage_lve, np.nan),
+            'Loss modulus Pa': np.where(count > 0, loss_lve, np.nan),
+            'LVE points': count,
+            'Critical strain': critical_strain,
+            'Flow point strain': flow_strain,
+            'Flow point modulus Pa': flow_modulus}
+
+
+#LVE table of a list of sweeps (DataFrames of read_anton_paar()), one row per
+#sweep, with the complex modulus |G*| of the LVE range
+def lve_table(sweeps, interval=AMPLITUDE_SWEEP, tolerance=0.05, skip=1):
+    strain, storage, loss = stack_sweeps(sweeps, interval)
+    table = pd.DataFrame(lve(strain, storage, loss, tolerance, skip))
+    table['Complex modulus Pa'] = np.hypot(table['Storage modulus Pa'], table['Loss modulus Pa'])
+    return table
@@ -0,0 +1,202 @@
+'''
+Batch rheology analysis
+
+Non-interactive version of Rheoplot.py for whole experiment folders. Every
+export named <set>_<n>.txt (e.g. adipo24_1.txt ... adipo24_4.txt) found in the
+folders, and in their sub-folders, is parsed, the files being read in
+parallel by a pool of threads. The LVE range of every sample is found by
+lve.py, all the samples at once, giving
+
+    G', G" (means over the LVE range), |G*| = sqrt(G'^2 + G"^2), E = 3|G*|,
+    the critical strain and the flow point
+
+and for every set of samples the mean and standard deviation of the moduli,
+with the bootstrap 95 % confidence interval of the mean (bootstrap.py).
+Frequency and time sweep intervals exported in the same files are analysed
+by sweeps.py and written to tables of their own. The results
+are written as two tables, one row per sample and one row per set, and one
+figure of G' and G" against the strain per set, drawn without pyplot so that
+no window is opened:
+
+    python rheobatch.py "Rheology experiment 21.04.2022" --out results
+
+With a ParseCache (the command line uses one unless --no-cache is given), the
+parsed exports are loaded from the cache when they have not changed.
+
+The LVE range and the figures are taken from the first interval of every
+export detected as an amplitude sweep. A file that cannot be parsed or holds
+no amplitude sweep is reported in the 'Error' column of the sample table and
+left out of its set.
+'''
+
+import os
+import re
+import sys
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+from matplotlib.figure import Figure
+
+from anton_paar import read_anton_paar, split_intervals, PARSER_VERSION
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from parsecache import ParseCache
+from bootstrap import bootstrap_table, DEFAULT_RESAMPLES
+from lve import lve_table, amplitude_sweep
+from sweeps import analyse
+
+
+SAMPLE_NAME = re.compile(r'^(?P<set>.+)_(?P<n>\d+)\.txt$')
+
+MODULI = ['Storage modulus Pa', 'Loss modulus Pa', 'Complex modulus Pa', 'Young modulus Pa']
+
+
+#Every (folder, set, sample number, path) under the given folders
+def discover(folders):
+    if isinstance(folders, str):
+        folders = [folders]
+    samples = []
+    for root in folders:
+        for folder, dirs, files in os.walk(root):
+            dirs.sort()
+            for name in files:
+                match = SAMPLE_NAME.match(name)
+                if match:
+                    samples.append((folder, match.group('set'), int(match.group('n')), os.path.join(folder, name)))
+    return sorted(samples)
+
+
+def _read(datapath, cache=None):
+    try:
+        if cache is not None:
+            return cache.load(datapath, read_anton_paar, PARSER_VERSION), None
+        return read_anton_paar(datapath), None
+    except Exception as err:
+        return None, '%s: %s' % (type(err).__name__, err)
+
+
+def set_figure(folder, sampleset, sweeps):
+    fig = Figure(figsize=(8,5))
+    ax = fig.add_subplot()
+    Handles = []
+    for i, (n, data) in enumerate(sweeps):
+        colour = 'C'+str(i % 10)
+        ax.loglog(data['Strain'], data['Storage'], '-s', color=colour)
+        ax.loglog(data['Strain'], data['Loss'], '--^', color=colour)
+        Handles.append('Sample '+str(n)+' G\'')
+        Handles.append('Sample '+str(n)+' G\"')
+    ax.set_title(os.path.basename(os.path.normpath(folder))+' - '+sampleset)
+    ax.set_xlabel('Shear strain $\\gamma$, %')
+    ax.set_ylabel('Storage modulus G\', Pa \nLoss modulus G\", Pa')
+    ax.legend(Handles, loc='best')
+    return fig
+
+
+#Sample and set tables of all the sample sets in the folders. With out, the
+#tables are saved there as CSV together with one figure per set
+def rheobatch(folders, out=None, workers=None, fmt='png', tolerance=0.05, cache=None, verbose=True,
+              resamples=DEFAULT_RESAMPLES):
+    samples = discover(folders)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        sweeps = list(pool.map(lambda datapath: _read(datapath, cache), [s[3] for s in samples]))
+
+    rows = []
+    by_set = {}
+    parsed = []
+    for (folder, sampleset, n, datapath), (data, error) in zip(samples, sweeps):
+        #The LVE range and the figures come from the amplitude sweep of the export
+        if data is not None:
+            try:
+                amplitude = amplitude_sweep(data)
+            except ValueError as err:
+                error = 'ValueError: %s' % err
+        if error is None:
+            by_set.setdefault((folder, sampleset), []).append((n, amplitude))
+            parsed.append(amplitude)
+        elif verbose:
+            print('Failed:', datapath, '-', error)
+        rows.append((folder, sampleset, n, datapath, error))
+    sample_table = pd.DataFrame(rows, columns=['Folder', 'Sample set', 'Sample', 'Path', 'Error'])
+
+    #LVE range of all the parsed samples in one pass
+    lve = lve_table(parsed, interval=None, tolerance=tolerance)
+    lve['Young modulus Pa'] = 3*lve['Complex modulus Pa']
+    lve.index = sample_table.index[sample_table['Error'].isna()]
+    sample_table = sample_table.join(lve)
+    sample_table = sample_table[['Folder', 'Sample set', 'Sample']+list(lve.columns)+['Path', 'Error']]
+
+    #Frequency and time sweep intervals exported with the amplitude sweeps
+    others = [(datapath, interval) for datapath, (data, error) in zip(sample_table['Path'], sweeps)
+              if data is not None for interval in split_intervals(data)
+              if interval.attrs['test'] in ('frequency sweep', 'time sweep')]
+    sweep_tables = analyse(others)
+
+    #Mean and standard deviation (np.std, as in Rheoplot.py) of every set
+    valid = sample_table[sample_table['Error'].isna()]
+    set_table = valid.groupby(['Folder', 'Sample set'], sort=True).agg(**{
+        'Samples': ('Sample', 'size'),
+        'Storage modulus Pa': ('Storage modulus Pa', 'mean'),
+        'Storage modulus std Pa': ('Storage modulus Pa', lambda x: np.std(x)),
+        'Loss modulus Pa': ('Loss modulus Pa', 'mean'),
+        'Loss modulus std Pa': ('Loss modulus Pa', lambda x: np.std(x)),
+        'Complex modulus Pa': ('Complex modulus Pa', 'mean'),
+        'Complex modulus std Pa': ('Complex modulus Pa', lambda x: np.std(x)),
+        'Young modulus Pa': ('Young modulus Pa', 'mean'),
+        'Young modulus std Pa': ('Young modulus Pa', lambda x: np.std(x))}).reset_index()
+
+    #Bootstrap 95 % confidence interval of the mean moduli, e.g. 'Complex modulus CI low Pa'
+    if len(set_table):
+        ci = bootstrap_table(valid, ['Folder', 'Sample set'], MODULI, resamples=resamples, seed=0)
+        ci = ci.rename(columns={name+' '+bound: name[:-3]+' CI '+bound+' Pa' for name in MODULI for bound in ('low', 'high')})
+        set_table = set_table.merge(ci.drop(columns=MODULI), on=['Folder', 'Sample set'], how='left')
+
+    if verbose:
+        for _, r in set_table.iterrows():
+            print('%s %s (%d samples): G = %.2f ± %.2f Pa (95 %% CI %.2f - %.2f), E = %.2f ± %.2f Pa' %
+                  (os.path.basename(os.path.normpath(r['Folder'])), r['Sample set'], r['Samples'],
+                   r['Complex modulus Pa'], r['Complex modulus std Pa'],
+                   r['Complex modulus CI low Pa'], r['Complex modulus CI high Pa'],
+                   r['Young modulus Pa'], r['Young modulus std Pa']))
+
+    if out is not None:
+        os.makedirs(out, exist_ok=True)
+        sample_table.to_csv(os.path.join(out, 'rheology_samples.csv'), index=False)
+        set_table.to_csv(os.path.join(out, 'rheology_summary.csv'), index=False)
+        for test, table in sweep_tables.items():
+            table.to_csv(os.path.join(out, 'rheology_'+test.replace(' ', '_')+'s.csv'), index=False)
+        for (folder, sampleset), sweeps in by_set.items():
+            fig = set_figure(folder, sampleset, sweeps)
+            name = os.path.basename(os.path.normpath(folder))+' - '+sampleset+'.'+fmt
+            fig.savefig(os.path.join(out, name), dpi=150, bbox_inches='tight')
+
+    return sample_table, set_table, sweep_tables
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Storage and loss moduli of every sample set in rheology folders')
+    parser.add_argument('folders', nargs='+')
+    parser.add_argument('--out', default='rheology_results')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--format', default='png')
+    parser.add_argument('--tolerance', type=float, default=0.05, help='fall of G\' that ends the LVE range')
+    parser.add_argument('--store', action='store_true', help='also append the moduli to the result store')
+    parser.add_argument('--no-cache', action='store_true', help='parse every export again')
+    parser.add_argument('--resamples', type=int, default=DEFAULT_RESAMPLES, help='bootstrap resamples per set')
+    args = parser.parse_args()
+
+    cache = None if args.no_cache else ParseCache()
+    sample_table, set_table, sweep_tables = rheobatch(args.folders, args.out, args.workers, args.format, args.tolerance, cache,
+                                                      resamples=args.resamples)
+
+    if args.store:
+        from resultstore import ResultStore, experiment_date
+        store = ResultStore()
+        for folder, table in sample_table[sample_table['Error'].isna()].groupby('Folder'):
+            experiment = os.path.basename(os.path.normpath(folder))
+            date = experiment_date(experiment)
+            if date is None:
+                print('Not stored, no date in the folder name:', folder)
+                continue
+            store.append('moduli', table, experiment=experiment, date=date, mode='overwrite')
@@ -0,0 +1,160 @@
+'''
+Frequency and time sweeps
+
+Analysis of the other intervals that the rheometer protocols export together
+with the amplitude sweep. As in lve.py, the intervals of one kind are stacked
+into (intervals, points) arrays padded with NaN and analysed all at once,
+sweeps exported from the high end down being turned round first.
+
+Frequency sweep (G' and G" against the angular frequency w, in the LVE range):
+
+    - G' and G" at a reference frequency (10 rad/s by default), interpolated
+      on log-log axes
+    - the power law exponents of G' ~ w^n' and G" ~ w^n", from a least squares
+      fit on log-log axes (n' close to 0 for a gel)
+    - the crossover frequency where G" goes above G', and the mean loss factor
+
+Time sweep (G' and G" against time at constant strain and frequency):
+
+    - the final G' and G", means over the last final fraction of the points
+    - the drift of G' over that last part, in % of the final G' per minute
+    - the time at which G' reaches 95 % of its final value (interpolated)
+    - the gel point, where G' rises above G", interpolated on log-log axes
+
+analyse() takes the intervals of iter_intervals() and returns one table per
+test, so a multi-interval export is read once and analysed in one call.
+'''
+
+import numpy as np
+import pandas as pd
+
+from anton_paar import iter_intervals
+from lve import stack_sweeps, first_true, zero_crossing, crossover, lve
+
+
+def _log10(x):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.log10(x)
+
+
+#Value of y at x0 on log-log axes for every row, NaN when x0 is out of range
+def _at(log_x, log_y, log_x0):
+    with np.errstate(invalid='ignore'):
+        above = log_x >= log_x0[:,None]
+    k = first_true(above, 1)
+    t, log_y0 = zero_crossing(log_y, np.where(np.isfinite(log_x), log_x-log_x0[:,None], 0), k)
+    exact = log_x[:,0] == log_x0
+    log_y0 = np.where(exact, log_y[:,0], log_y0)
+    with np.errstate(invalid='ignore'):
+        inside = (k > 0) & (log_x[:,0] < log_x0)
+    return np.where(inside | exact, 10**log_y0, np.nan)
+
+
+#Slope of the least squares line of y against x for every row, ignoring NaN
+def _slope(x, y):
+    valid = np.isfinite(x) & np.isfinite(y)
+    n = valid.sum(axis=1)
+    x = np.where(valid, x, 0.0)
+    y = np.where(valid, y, 0.0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mx = x.sum(axis=1)/n
+        my = y.sum(axis=1)/n
+        dx = np.where(valid, x-mx[:,None], 0.0)
+        dy = np.where(valid, y-my[:,None], 0.0)
+        slope = (dx*dy).sum(axis=1)/(dx*dx).sum(axis=1)
+    return np.where(n >= 2, slope, np.nan)
+
+
+def frequency_sweep(frequency, storage, loss, reference=10.0):
+    log_w, log_storage, log_loss = _log10(frequency), _log10(storage), _log10(loss)
+
+    log_reference = np.full(len(log_w), np.log10(reference))
+    crossover_w, crossover_modulus = crossover(log_w, log_storage, log_loss)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        loss_factor = np.nanmean(10**(log_loss-log_storage), axis=1)
+    return {'Storage modulus at reference Pa': _at(log_w, log_storage, log_reference),
+            'Loss modulus at reference Pa': _at(log_w, log_loss, log_reference),
+            'Storage exponent': _slope(log_w, log_storage),
+            'Loss exponent': _slope(log_w, log_loss),
+            'Crossover frequency': crossover_w,
+            'Crossover modulus Pa': crossover_modulus,
+            'Mean loss factor': loss_factor}
+
+
+def time_sweep(time, storage, loss, final=0.1):
+    points = np.arange(storage.shape[1])
+    count = np.isfinite(storage).sum(axis=1)
+    first_final = np.floor(count*(1-final)).astype(int)
+    first_final = np.minimum(first_final, np.maximum(count-2, 0))
+    in_final = (points >= first_final[:,None]) & (points < count[:,None])
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        final_storage = np.where(in_final, storage, 0).sum(axis=1)/in_final.sum(axis=1)
+        final_loss = np.where(in_final, loss, 0).sum(axis=1)/in_final.sum(axis=1)
+        #Slope in Pa/s over the final part, as % of the final G' per minute
+        drift = 100*60*_slope(np.where(in_final, time, np.nan), np.where(in_final, storage, np.nan))/final_storage
+
+        reached = storage >= 0.95*final_storage[:,None]
+    k = first_true(reached, 0)
+    t, t95 = zero_crossing(time, np.where(np.isfinite(storage), storage-0.95*final_storage[:,None], 0), k)
+    t95 = np.where(k > 0, t95, np.where(k == 0, time[:,0], np.nan))
+
+    gel_time, gel_modulus = crossover(_log10(time), _log10(storage), _log10(loss), rising=True)
+    return {'Final storage modulus Pa': final_storage,
+            'Final loss modulus Pa': final_loss,
+            'Drift %/min': drift,
+            'Time to 95 % s': t95,
+            'Gel point time s': gel_time,
+            'Gel point modulus Pa': gel_modulus}
+
+
+#Column swept in the intervals of a test
+SWEPT = {'amplitude sweep': 'Strain', 'frequency sweep': 'Angular frequency', 'time sweep': 'Time'}
+
+
+def _swept(interval, test):
+    if test == 'frequency sweep' and 'Angular frequency' not in interval and 'Frequency' in interval:
+        #Frequency in Hz
+        interval = interval.assign(**{'Angular frequency': 2*np.pi*interval['Frequency']})
+    if test == 'time sweep' and 'Time' not in interval:
+        #Points taken at regular intervals, the time is counted in points
+        interval = interval.assign(Time=interval['Point'].astype(np.float64))
+    #Sweeps going down (e.g. the down amplitude sweep) are analysed from the low end
+    x = interval[SWEPT[test]].to_numpy()
+    if len(x) > 1 and x[-1] < x[0]:
+        interval = interval.iloc[::-1]
+    return interval
+
+
+#One table per test ('amplitude sweep', 'frequency sweep', 'time sweep') for
+#intervals of iter_intervals(), given alone or as (name, interval) pairs
+def analyse(intervals, tolerance=0.05, reference=10.0, final=0.1):
+    by_test = {}
+    for item in intervals:
+        name, interval = item if isinstance(item, tuple) else (None, item)
+        test = interval.attrs.get('test', 'unknown')
+        if test in SWEPT:
+            by_test.setdefault(test, []).append((name, interval))
+
+    tables = {}
+    for test, items in by_test.items():
+        x, storage, loss = stack_sweeps([_swept(i, test) for _, i in items], interval=None, x=SWEPT[test])
+        if test == 'amplitude sweep':
+            table = pd.DataFrame(lve(x, storage, loss, tolerance))
+            table['Complex modulus Pa'] = np.hypot(table['Storage modulus Pa'], table['Loss modulus Pa'])
+        elif test == 'frequency sweep':
+            table = pd.DataFrame(frequency_sweep(x, storage, loss, reference))
+        else:
+            table = pd.DataFrame(time_sweep(x, storage, loss, final))
+        table.insert(0, 'Interval', [i.attrs.get('interval') for _, i in items])
+        if any(name is not None for name, _ in items):
+            table.insert(0, 'Name', [name for name, _ in items])
+        tables[test] = table
+    return tables
+
+
+#Analyse every interval of the exports, reading each file once
+def analyse_files(paths, **kwargs):
+    if isinstance(paths, str):
+        paths = [paths]
+    return analyse(((datapath, interval) for datapath in paths for interval in iter_intervals(datapath)), **kwargs)
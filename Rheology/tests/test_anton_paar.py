@@ -0,0 +1,43 @@
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from anton_paar import read_anton_paar, iter_intervals
+from lve import amplitude_sweep, lve_table
+
+HEADER = 'Point No.\tTime\tShear Strain\tShear Stress\tStorage Modulus\tLoss Modulus\t\n\t[s]\t[%]\t[Pa]\t[Pa]\t[Pa]\t\n'
+
+
+def _rows(time, strain, stress, storage, loss):
+    return ''.join('%d\t%s\t%s\t%s\t%s\t%s\t\n' % ((k+1,)+tuple(('%g' % v).replace('.', ',') for v in values))
+                   for k, values in enumerate(zip(time, strain, stress, storage, loss)))
+
+
+#A gelation time sweep at a fixed strain, the stress rising tenfold as the gel
+#sets, then the amplitude sweep of the gel, each interval under its own header
+def _export(path):
+    n = 20
+    gelation = _rows(np.arange(n)*30.0, np.full(n, 0.1), np.linspace(0.02, 0.2, n),
+                     np.linspace(20, 200, n), np.full(n, 15.0))
+    strain = np.logspace(-2, 2, n)
+    storage = np.where(strain < 5, 250.0, 250.0*(5/strain))
+    amplitude = _rows(np.arange(n)*10.0, strain, strain*storage/100, storage, np.full(n, 100.0))
+    with open(path, 'w', encoding='latin-1') as f:
+        f.write('Interval 1\n\n'+HEADER+gelation+'\nInterval 2\n\n'+HEADER+amplitude)
+
+
+def test_time_sweep_then_amplitude_sweep(tmp_path):
+    path = str(tmp_path/'gel_1.txt')
+    _export(path)
+
+    data = read_anton_paar(path)
+    assert data.attrs['tests'] == ['time sweep', 'amplitude sweep']
+    assert [interval.attrs['test'] for interval in iter_intervals(path)] == ['time sweep', 'amplitude sweep']
+
+    #The LVE range is that of the amplitude sweep, not of the setting gel
+    sweep = amplitude_sweep(data)
+    assert (sweep['Interval'] == 2).all()
+    lve = lve_table([data]).iloc[0]
+    assert abs(lve['Storage modulus Pa']-250) < 1e-6
@@ -0,0 +1,142 @@
+"""
+Bootstrap confidence intervals
+
+The summaries of the experiments are means over a handful of replicates (4 or
+5 rheology samples per set, a few images per cell density condition) reported
+as mean ± standard deviation, or with no spread at all. bootstrap() gives the
+percentile confidence interval of a statistic of such a group:
+
+    estimate, low, high = bootstrap(Gt, 'mean', resamples=10000)
+
+No resample is drawn in a Python loop: the indices of all the resamples are
+drawn at once as one (n, resamples) integer matrix, the values are taken with
+it in one fancy indexing step and the statistic is applied along the rows, so
+10^4 - 10^5 resamples of a group take a few milliseconds. Large groups are
+resampled in chunks of the matrix to bound the memory.
+
+A group of fewer than MIN_VALUES values has no spread to resample: its
+statistic is returned with a NaN interval rather than a zero-width one.
+
+bootstrap_table() does it for every group of a DataFrame and for several
+columns, the columns of a group sharing the same resamples. With many groups
+(POOL_GROUPS or more, or workers given) the groups are spread over a pool of
+worker processes. Every group draws from its own random stream spawned from
+seed, so the intervals do not depend on how the groups are split between the
+workers and are the same from run to run for a given seed.
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+
+DEFAULT_RESAMPLES = 10000
+DEFAULT_CONFIDENCE = 0.95
+
+#Fewest values of a group for which an interval is given
+MIN_VALUES = 2
+
+#Groups from which bootstrap_table() uses a process pool when workers is not given
+POOL_GROUPS = 200
+
+#Largest number of values taken at once from a group, 2^22 float64 = 32 MB
+CHUNK = 1 << 22
+
+#Statistics that can be given by name, all applied along an axis. np.std is the
+#population standard deviation, as in Rheoplot.py
+STATISTICS = {'mean': np.mean, 'median': np.median, 'std': np.std,
+              'nanmean': np.nanmean, 'nanmedian': np.nanmedian}
+
+
+def _statistic(statistic):
+    if isinstance(statistic, str):
+        try:
+            return STATISTICS[statistic]
+        except KeyError:
+            raise ValueError('Unknown statistic %r, use one of %s or a function taking axis'
+                             % (statistic, ', '.join(STATISTICS))) from None
+    return statistic
+
+
+#Statistic of every resample of the columns of values (n, columns), as a
+#(resamples, columns) array. The index matrix is drawn chunk by chunk
+def _resample(values, statistic, resamples, rng):
+    n = len(values)
+    chunk = max(1, CHUNK//max(n*values.shape[1], 1))
+    stats = np.empty((resamples, values.shape[1]))
+    for start in range(0, resamples, chunk):
+        stop = min(start+chunk, resamples)
+        #(n, resamples, columns): the statistic adds up whole rows of resamples
+        #rather than running along the short rows of n values
+        index = rng.integers(0, n, size=(n, stop-start))
+        stats[start:stop] = statistic(values[index], axis=0)
+    return stats
+
+
+#Statistic of the values, with the lower and upper bounds of its percentile
+#confidence interval. NaN values are left out, NaN is returned for no values and
+#NaN bounds for fewer than MIN_VALUES.
+#seed can be an int, a SeedSequence or a Generator
+def bootstrap(values, statistic='mean', resamples=DEFAULT_RESAMPLES, confidence=DEFAULT_CONFIDENCE, seed=None):
+    estimate, low, high = _bootstrap_group(np.asarray(values, dtype=np.float64).reshape(-1, 1),
+                                           _statistic(statistic), resamples, confidence, seed)
+    return estimate[0], low[0], high[0]
+
+
+def _bootstrap_group(values, statistic, resamples, confidence, seed):
+    values = values[np.isfinite(values).all(axis=1)]
+    if not len(values):
+        nan = np.full(values.shape[1], np.nan)
+        return nan, nan, nan
+    if len(values) < MIN_VALUES:
+        nan = np.full(values.shape[1], np.nan)
+        return statistic(values, axis=0), nan, nan
+    rng = seed if isinstance(seed, np.random.Generator) else np.random.default_rng(seed)
+    stats = _resample(values, statistic, resamples, rng)
+    alpha = (1-confidence)/2
+    low, high = np.quantile(stats, [alpha, 1-alpha], axis=0)
+    return statistic(values, axis=0), low, high
+
+
+def _bootstrap_groups(groups, statistic, resamples, confidence):
+    return [_bootstrap_group(values, statistic, resamples, confidence, seed) for values, seed in groups]
+
+
+#Bootstrap interval of the statistic of the columns for every group of the
+#table (by as in DataFrame.groupby). One row per group with, for every column,
+#the statistic and its bounds in '<column> low' and '<column> high'. The rows
+#with a NaN in one of the columns are left out of their group
+def bootstrap_table(table, by, columns, statistic='mean', resamples=DEFAULT_RESAMPLES,
+                    confidence=DEFAULT_CONFIDENCE, seed=None, workers=None):
+    if isinstance(columns, str):
+        columns = [columns]
+    statistic = _statistic(statistic)
+    names = [by] if isinstance(by, str) else list(by)
+    grouped = table.groupby(names if len(names) > 1 else names[0], sort=True)
+    keys = list(grouped.indices)
+    values = table[columns].to_numpy(np.float64)
+    seeds = np.random.SeedSequence(seed).spawn(len(keys))
+    groups = [(values[grouped.indices[key]], s) for key, s in zip(keys, seeds)]
+
+    if workers is None and len(groups) >= POOL_GROUPS:
+        workers = os.cpu_count()
+    if workers is not None and workers > 1 and len(groups) > 1:
+        #A few large tasks per worker rather than one task per group
+        size = -(-len(groups)//(4*workers))
+        chunks = [groups[i:i+size] for i in range(0, len(groups), size)]
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = [r for part in pool.map(_bootstrap_groups, chunks, [statistic]*len(chunks),
+                                              [resamples]*len(chunks), [confidence]*len(chunks))
+                       for r in part]
+    else:
+        results = _bootstrap_groups(groups, statistic, resamples, confidence)
+
+    index = pd.MultiIndex.from_tuples(keys, names=names) if len(names) > 1 else pd.Index(keys, name=names[0])
+    summary = pd.DataFrame(index=index)
+    for i, column in enumerate(columns):
+        summary[column] = [r[0][i] for r in results]
+        summary[column+' low'] = [r[1][i] for r in results]
+        summary[column+' high'] = [r[2][i] for r in results]
+    return summary.reset_index()
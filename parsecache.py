@@ -0,0 +1,180 @@
+"""
+Parsed file cache
+
+The text exports of the instruments (Anton Paar .txt, Promega GloMax .csv, the
+trypan blue plate) are parsed again by every analysis and notebook session.
+ParseCache keeps the DataFrame returned by a parser as a binary .npz file,
+one array per column, and loads it back instead of parsing the text again:
+
+    cache = ParseCache()
+    data = cache.load(datapath, read_anton_paar, PARSER_VERSION)
+
+The entries are listed in an index (index.json) keyed on the absolute path of
+the file and the name of the parser, and an entry is only used while the size
+and the modification time of the file and the version of the parser are those
+recorded with it. Editing or replacing a file, or bumping the version of a
+parser whose output changes, makes the next load parse the file again.
+
+Numeric and boolean columns are stored as they are, text columns as unicode
+arrays, categorical columns as their codes and categories, and the index and
+the attrs of the DataFrame are kept as well. The cache is in .parse_cache at
+the root of the repository unless PARSE_CACHE gives another location.
+"""
+
+import os
+import json
+import hashlib
+import tempfile
+import threading
+
+import numpy as np
+import pandas as pd
+
+
+DEFAULT_ROOT = os.environ.get('PARSE_CACHE', os.path.join(os.path.dirname(os.path.abspath(__file__)), '.parse_cache'))
+
+INDEX_NAME = 'index.json'
+INDEX_VERSION = 1
+
+#Bump when the layout of the .npz entries changes
+ENTRY_VERSION = 1
+
+
+def _to_arrays(data):
+    arrays = {}
+    columns = []
+    blocks = {}
+    for i, name in enumerate(data.columns):
+        column = data[name]
+        key = 'c%d' % i
+        if isinstance(column.dtype, pd.CategoricalDtype):
+            arrays[key] = column.cat.codes.to_numpy()
+            arrays[key+'_categories'] = column.cat.categories.astype(str).to_numpy(dtype=str)
+            columns.append([str(name), 'category', key, 0])
+        elif column.dtype.kind in 'biufcmM':
+            #Numeric columns of the same type go into one 2D block, an .npz
+            #member costs more to open than to read for the small exports
+            block = 'b_'+column.dtype.str.strip('<>|=')
+            blocks.setdefault(block, []).append(column.to_numpy())
+            columns.append([str(name), 'array', block, len(blocks[block])-1])
+        else:
+            arrays[key] = column.astype(str).to_numpy(dtype=str)
+            arrays[key+'_null'] = column.isna().to_numpy()
+            columns.append([str(name), 'text', key, 0])
+    for block, values in blocks.items():
+        arrays[block] = np.column_stack(values)
+    index = data.index
+    arrays['index'] = index.to_numpy() if index.dtype.kind in 'biuf' else index.astype(str).to_numpy(dtype=str)
+    meta = {'columns':columns, 'index_name':index.name, 'attrs':data.attrs}
+    arrays['meta'] = np.array(json.dumps(meta))
+    return arrays
+
+
+def _from_arrays(entry):
+    entry = {name: entry[name] for name in entry.files}
+    meta = json.loads(str(entry['meta']))
+    data = {}
+    for name, kind, key, position in meta['columns']:
+        if kind == 'category':
+            data[name] = pd.Categorical.from_codes(entry[key], entry[key+'_categories'])
+        elif kind == 'text':
+            values = entry[key].astype(object)
+            values[entry[key+'_null']] = None
+            data[name] = values
+        else:
+            data[name] = entry[key][:, position]
+    table = pd.DataFrame(data, index=pd.Index(entry['index'], name=meta['index_name']))
+    table.attrs.update(meta['attrs'])
+    return table
+
+
+class ParseCache:
+
+    def __init__(self, root=DEFAULT_ROOT):
+        self.root = root
+        self.index_path = os.path.join(root, INDEX_NAME)
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+        self._index = {}
+        try:
+            with open(self.index_path) as f:
+                index = json.load(f)
+            if index.get('version') == INDEX_VERSION:
+                self._index = index['entries']
+        except (OSError, ValueError):
+            pass
+
+    def _save(self):
+        fd, tmp = tempfile.mkstemp(dir=self.root, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump({'version':INDEX_VERSION, 'entries':self._index}, f)
+        os.replace(tmp, self.index_path)
+
+    @staticmethod
+    def _key(datapath, parser):
+        return os.path.abspath(datapath)+'::'+parser.__module__+'.'+parser.__qualname__
+
+    #DataFrame of the file parsed by parser, from the cache when the file and the
+    #parser version are those of the cached entry, else parsed now and cached
+    def load(self, datapath, parser, version=1):
+        key = self._key(datapath, parser)
+        st = os.stat(datapath)
+        stamp = {'size':st.st_size, 'mtime_ns':st.st_mtime_ns, 'version':version, 'entry':ENTRY_VERSION}
+
+        with self._lock:
+            entry = self._index.get(key)
+        if entry is not None and all(entry[k] == v for k, v in stamp.items()):
+            try:
+                with np.load(os.path.join(self.root, entry['file'])) as arrays:
+                    return _from_arrays(arrays)
+            except (OSError, KeyError, ValueError):
+                pass
+
+        data = parser(datapath)
+        self.put(key, stamp, data)
+        return data
+
+    def put(self, key, stamp, data):
+        name = hashlib.blake2b(key.encode(), digest_size=16).hexdigest()+'.npz'
+        fd, tmp = tempfile.mkstemp(dir=self.root, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.savez(f, **_to_arrays(data))
+            os.replace(tmp, os.path.join(self.root, name))
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        with self._lock:
+            #Another process may have added entries since the index was read
+            try:
+                with open(self.index_path) as f:
+                    index = json.load(f)
+                if index.get('version') == INDEX_VERSION:
+                    index['entries'].update(self._index)
+                    self._index = index['entries']
+            except (OSError, ValueError):
+                pass
+            self._index[key] = dict(stamp, file=name)
+            self._save()
+
+    def clear(self):
+        with self._lock:
+            for entry in self._index.values():
+                try:
+                    os.remove(os.path.join(self.root, entry['file']))
+                except OSError:
+                    pass
+            self._index = {}
+            self._save()
+
+
+#Parser with the same signature as parser(datapath) that goes through the cache
+def cached(parser, version=1, cache=None):
+    cache = cache if cache is not None else ParseCache()
+
+    def load(datapath):
+        return cache.load(datapath, parser, version)
+    load.__name__ = parser.__name__
+    load.__doc__ = parser.__doc__
+    return load
@@ -0,0 +1,179 @@
+"""
+Experiment result store
+
+The results of the analysis scripts (cell densities from the images, moduli
+from the rheometer, insulin concentrations from the ELISA plates and the P-Q
+calibration points of the flow controller) are appended to one columnar store
+instead of being lost with the session, so that results of different
+experiments and years can be compared without running the raw analyses again.
+
+The store is a folder of Parquet files, one dataset per kind of result, each
+partitioned by experiment and date (hive layout):
+
+    <root>/density/Experiment=MIN6 cell density/Date=2021-05-12/part-....parquet
+
+Every kind has a fixed schema (SCHEMAS), and a table is cast to it before it
+is written, so a column of the wrong type is an error at write time rather
+than when the results are read years later. Every write adds a new file,
+written to a temporary name first, so an interrupted script never leaves half
+a file behind. The date of the experiment has to be given, there is no
+default. A script that is run again on the same data writes with
+mode='overwrite': once the new file is in place, the files written before to
+the partition (Experiment, Date) are removed, or only those of the same run
+when a run key is given (e.g. the plate of an ELISA, several plates sharing
+the partition of their date), so the results are never duplicated. Reads go through pyarrow.dataset: the partitions
+and the row groups that do not match the filters are skipped without being
+read.
+
+    store = ResultStore()
+    store.append('moduli', table, experiment='Rheology hydroscaffold', date='2022-04-21', mode='overwrite')
+    store.append('insulin', plate_table, experiment='GSIS', date='2021-06-10', mode='overwrite', run=plate)
+    store.read('density', Condition='3D', Day=['day6', 'day7'])
+
+The store is in the Results folder of the repository unless RESULT_STORE gives
+another location, so that the scripts of all the experiments share it.
+"""
+
+import os
+import re
+import uuid
+import hashlib
+import datetime
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+
+DEFAULT_ROOT = os.environ.get('RESULT_STORE', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Results'))
+
+MODES = ('append', 'overwrite')
+
+PARTITIONING = ds.partitioning(pa.schema([('Experiment', pa.string()), ('Date', pa.string())]), flavor='hive')
+
+SCHEMAS = {
+    #Celldenisty.py / run_batch()
+    'density': pa.schema([('Condition', pa.string()), ('Day', pa.string()),
+                          ('Cell concentration', pa.string()), ('Replicate', pa.int32()), ('Density', pa.float64()),
+                          ('Path', pa.string())]),
+    #Rheoplot.py, one row per sample
+    'moduli': pa.schema([('Sample set', pa.string()), ('Sample', pa.int32()),
+                         ('Storage modulus Pa', pa.float64()), ('Loss modulus Pa', pa.float64()),
+                         ('Complex modulus Pa', pa.float64())]),
+    #ELISA.py, one row per well
+    'insulin': pa.schema([('Plate', pa.string()), ('Well', pa.string()), ('Group', pa.string()),
+                          ('Optical density', pa.float64()), ('Dilution', pa.float64()),
+                          ('Insulin ug/L', pa.float64()), ('Replicate', pa.int32()),
+                          ('Timepoint min', pa.float64()), ('In range', pa.bool_())]),
+    #pressure_flow_regression.py, the measured points of a P-Q calibration
+    'pq': pa.schema([('Pressure mbar', pa.float64()), ('Flow ul/min', pa.float64())]),
+}
+
+
+#Date written in a file or folder name, as 21.04.2022, 10-06-2021 or 23_Mar_2021,
+#in ISO format, or None
+def experiment_date(name):
+    match = re.search(r'(\d{1,2})[._ -](\d{1,2}|[A-Za-z]{3})[._ -](\d{4})', name)
+    if match is None:
+        return None
+    day, month, year = match.groups()
+    try:
+        if month.isdigit():
+            date = datetime.date(int(year), int(month), int(day))
+        else:
+            date = datetime.datetime.strptime(day+' '+month+' '+year, '%d %b %Y').date()
+    except ValueError:
+        return None
+    return date.strftime('%Y-%m-%d')
+
+
+class ResultStore:
+
+    def __init__(self, root=DEFAULT_ROOT):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def _schema(self, kind):
+        try:
+            return SCHEMAS[kind]
+        except KeyError:
+            raise ValueError('Unknown kind of result: '+str(kind)) from None
+
+    #Append a DataFrame (or Arrow table) of results of one experiment. Columns
+    #that are not in the schema of the kind are dropped, missing ones are null.
+    #With mode='overwrite' the earlier files of the partition, or of the run
+    #when given, are replaced, see the module docstring
+    def append(self, kind, table, experiment, date, mode='append', run=None):
+        schema = self._schema(kind)
+        if mode not in MODES:
+            raise ValueError('mode must be append or overwrite, not %r' % mode)
+        if date is None:
+            raise ValueError('No date given for the results of '+str(experiment))
+        if isinstance(date, (datetime.date, datetime.datetime)):
+            date = date.strftime('%Y-%m-%d')
+
+        if isinstance(table, pd.DataFrame):
+            table = pa.Table.from_pandas(table, preserve_index=False)
+        columns = [table.column(f.name) if f.name in table.column_names else pa.nulls(table.num_rows, f.type)
+                   for f in schema]
+        table = pa.Table.from_arrays(columns, schema=pa.schema([f.with_nullable(True) for f in schema])).cast(schema)
+
+        folder = os.path.join(self.root, kind, 'Experiment='+str(experiment), 'Date='+str(date))
+        os.makedirs(folder, exist_ok=True)
+        #The run is kept in the file name, as a hash so that any string can be a key
+        prefix = 'part-' if run is None else 'part-run%s-' % hashlib.sha1(str(run).encode()).hexdigest()[:12]
+        name = prefix+'%s-%s.parquet' % (datetime.datetime.now().strftime('%Y%m%d%H%M%S%f'), uuid.uuid4().hex[:8])
+        earlier = [f for f in os.listdir(folder) if f.startswith(prefix) and f.endswith('.parquet')]
+        tmp = os.path.join(folder, '.'+name+'.tmp')
+        try:
+            pq.write_table(table, tmp)
+            os.replace(tmp, os.path.join(folder, name))
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        if mode == 'overwrite':
+            for f in earlier:
+                os.remove(os.path.join(folder, f))
+        return os.path.join(folder, name)
+
+    def dataset(self, kind):
+        schema = self._schema(kind)
+        path = os.path.join(self.root, kind)
+        if not os.path.isdir(path):
+            return None
+        return ds.dataset(path, format='parquet', partitioning=PARTITIONING,
+                          schema=pa.unify_schemas([schema, PARTITIONING.schema]),
+                          exclude_invalid_files=False, ignore_prefixes=['.', '_'])
+
+    #Results of one kind as a DataFrame. Every keyword is a condition on a column
+    #(underscores standing for spaces, Cell_concentration='1k'): a single value
+    #for equality, a list for any of the values. filter takes any
+    #other pyarrow.dataset expression, e.g. ds.field('Density') > 20
+    def read(self, kind, columns=None, filter=None, experiment=None, date=None, **where):
+        dataset = self.dataset(kind)
+        if dataset is None:
+            schema = pa.unify_schemas([self._schema(kind), PARTITIONING.schema])
+            return schema.empty_table().to_pandas()[columns or schema.names]
+
+        if experiment is not None:
+            where['Experiment'] = experiment
+        if date is not None:
+            where['Date'] = date
+        expression = filter
+        for name, value in where.items():
+            name = name.replace('_', ' ') if name not in dataset.schema.names else name
+            if isinstance(value, (list, tuple, set)):
+                condition = ds.field(name).isin(list(value))
+            else:
+                condition = ds.field(name) == value
+            expression = condition if expression is None else expression & condition
+        return dataset.to_table(columns=columns, filter=expression).to_pandas()
+
+    def experiments(self, kind):
+        dataset = self.dataset(kind)
+        if dataset is None:
+            return pd.DataFrame(columns=['Experiment', 'Date'])
+        return (dataset.to_table(columns=['Experiment', 'Date']).to_pandas()
+                .drop_duplicates().sort_values(['Date', 'Experiment'], ignore_index=True))